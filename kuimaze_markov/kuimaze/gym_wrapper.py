@@ -28,9 +28,11 @@ class MazeEnv(gym.Env):
     metadata = {'render.modes': ['human']}
     _path = []
     _visited = []
+    _visited_grid = None
     MAP = '../maps/easy/easy3.bmp'
 
-    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None):
+    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None,
+                 hard_places_are_goals=True, verbose=False):
         '''
         Class wrapping Maze into gym enviroment.
         @param informed: boolean
@@ -38,6 +40,8 @@ class MazeEnv(gym.Env):
         @param deter: boolean - T = deterministic maze, F = probabilistic maze
         @param map_image_dir: string - path to image of map
         @param grad: tuple - vector tuning the tilt of maze`
+        @param hard_places_are_goals: boolean - T = hard places end the episode like goals, F = they are just expensive
+        @param verbose: boolean - T = print diagnostic messages of the maze to stdout
         '''
         if map_image_dir is None:
             '''
@@ -54,7 +58,8 @@ class MazeEnv(gym.Env):
             self._grad = (0, 0)
         else:
             self._grad = grad
-        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards)
+        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards,
+                                     hard_places_are_goals=hard_places_are_goals, verbose=verbose)
         self._player = EnvAgent(self._problem)
         self._curr_state = self._problem.get_start_state()
         self._informed = informed
@@ -78,8 +83,7 @@ class MazeEnv(gym.Env):
             action = self._problem.non_det_result(action)
         self._curr_state = self._problem.result(self._curr_state, action)
         self._path.append(self._curr_state)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._mark_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         # reward = self._problem.get_state_reward(self._curr_state)
         return self._get_observation(), reward, done, None
@@ -96,14 +100,35 @@ class MazeEnv(gym.Env):
         self._gui_disabled = True
         self._path = []
         self._visited = []
+        self._visited_grid = np.zeros((self._xsize, self._ysize), dtype=bool)
         self._problem.clear_player_data()
         self._problem.set_player(self._player)
         if self._gym_compatible:
             self._path.append(self._problem.get_start_state())
-        self._visited.append(self._problem.get_start_state())
+        self._mark_visited(self._problem.get_start_state())
         self._curr_state = self._problem.get_start_state()
         return self._get_observation()
 
+    def _mark_visited(self, new_state):
+        '''
+        Records the state as visited. Visited states are kept in a boolean grid for constant time lookup
+        and in a list ordered by the time of the first visit, which is used for rendering.
+        @param new_state: namedtuple state
+        @return: None
+        '''
+        if not self._visited_grid[new_state.x, new_state.y]:
+            self._visited_grid[new_state.x, new_state.y] = True
+            self._visited.append(new_state)
+
+    def _is_visited(self, new_state):
+        '''
+        returns true if the state has already been visited
+        @param new_state: namedtuple state
+        @return: boolean
+        '''
+        return 0 <= new_state.x < self._xsize and 0 <= new_state.y < self._ysize and \
+            bool(self._visited_grid[new_state.x, new_state.y])
+
     def render(self, mode='human', close=False, visited=None, explored=None):
         assert self._set, "reset() must be called first!"
         self._gui_disabled = False
@@ -256,16 +281,16 @@ class EasyMazeEnv(MazeEnv):
     Unlike the HardMaze, EasyMaze has additional method set_path - which can set different path than agent movement.
     '''
 
-    def __init__(self, informed, map_image_dir=None, grad=(0, 0)):
-        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad)
+    def __init__(self, informed, map_image_dir=None, grad=(0, 0), hard_places_are_goals=True, verbose=False):
+        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad,
+                                          hard_places_are_goals=hard_places_are_goals, verbose=verbose)
         self._gui_on = False
 
     def step(self, action):
         last_state = self._curr_state
         assert (type(action) == list or type(action) == tuple) and len(action) == 2
         self._curr_state = self._easy_result(action)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._mark_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         return self._get_observation(), reward, done, None
 
@@ -300,13 +325,9 @@ class EasyMazeEnv(MazeEnv):
         @param new_state:
         @return: boolean
         '''
-        tmp = []
-        tmp.extend(self._visited)
-        tmp.extend([self._problem.result(self._curr_state, 0), self._problem.result(self._curr_state, 1),
-                    self._problem.result(self._curr_state, 2), self._problem.result(self._curr_state, 3),
-                    self._problem.result(self._curr_state, 4), self._problem.result(self._curr_state, 5),
-                    self._problem.result(self._curr_state, 6), self._problem.result(self._curr_state, 6)])
-        return new_state in tmp
+        if self._is_visited(new_state):
+            return True
+        return any(new_state == self._problem.result(self._curr_state, action) for action in range(8))
 
     def _easy_result(self, state_list):
         '''
@@ -360,8 +381,7 @@ class EasyMazeEnv(MazeEnv):
         for new_state in tmp:
             if new_state.x == maze_pose.x and new_state.y == maze_pose.y:
                 continue
-            if new_state not in self._visited:
-                self._visited.append(new_state)
+            self._mark_visited(new_state)
             reward = self._get_cost(maze_pose, new_state)
             expanded_nodes.append([(new_state.x, new_state.y), reward])
         return expanded_nodes
@@ -396,8 +416,8 @@ class InfEasyMaze(EasyMazeEnv):
     informed easy maze, suitable for A* implementation
     step([x, y])
     '''
-    def __init__(self, map_image=None, grad=(0, 0)):
-        super(InfEasyMaze, self).__init__(True, map_image, grad)
+    def __init__(self, map_image=None, grad=(0, 0), verbose=False):
+        super(InfEasyMaze, self).__init__(True, map_image, grad, hard_places_are_goals=False, verbose=verbose)
 
 
 class EasyMaze(EasyMazeEnv):
@@ -405,20 +425,20 @@ class EasyMaze(EasyMazeEnv):
     uninformed easy maze, suitable for BFS, DFS ...
     step([x, y])
     '''
-    def __init__(self, map_image=None, grad=(0, 0)):
-        super(EasyMaze, self).__init__(False, map_image, grad)
+    def __init__(self, map_image=None, grad=(0, 0), verbose=False):
+        super(EasyMaze, self).__init__(False, map_image, grad, verbose=verbose)
 
 
 class MDPMaze(MazeEnv):
     '''
     maze for solving MDP problems
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
         if probs is not None:
-            super().__init__(False, True, False, map_image, grad, node_rewards=node_rewards)
+            super().__init__(False, True, False, map_image, grad, node_rewards=node_rewards, verbose=verbose)
             self._problem.set_probs_table(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super().__init__(False, True, True, map_image, grad)
+            super().__init__(False, True, True, map_image, grad, verbose=verbose)
 
     def _get_reward(self, curr, last):
         '''
@@ -453,6 +473,13 @@ class MDPMaze(MazeEnv):
     def get_next_states_and_probs(self, state, action):
         return self._problem.get_next_states_and_probs(state, action)
 
+    def get_transition_model(self):
+        '''
+        auxiliary function for vectorized MDP solvers - transition model of the maze as arrays, see Maze.get_transition_model
+        :return: namedtuple with fields states, state_index, next_state_index, prob, reward, terminal
+        '''
+        return self._problem.get_transition_model()
+
     def get_state_reward(self,curr):
         return self._problem.get_state_reward(curr)
 
@@ -462,12 +489,12 @@ class HardMaze(MazeEnv):
     Uninformed hard maze, suitable for reinforcement learning
     step(param) where param is integer; 0 <= param <= 3
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
         if probs is not None:
-            super(HardMaze, self).__init__(False, True, False, map_image, grad, node_rewards=node_rewards)
+            super(HardMaze, self).__init__(False, True, False, map_image, grad, node_rewards=node_rewards, verbose=verbose)
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super(HardMaze, self).__init__(False, True, True, map_image, grad)
+            super(HardMaze, self).__init__(False, True, True, map_image, grad, verbose=verbose)
 
     def _get_reward(self, curr, last):
         '''
@@ -495,9 +522,9 @@ class InfHardMaze(MazeEnv):
     Informed hard maze, suitable for reinforcement learning
     step(param) where param is integer; 0 <= param <= 3
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, verbose=False):
         if probs is not None:
-            super(InfHardMaze, self).__init__(True, True, False, map_image, grad)
+            super(InfHardMaze, self).__init__(True, True, False, map_image, grad, verbose=verbose)
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super(InfHardMaze, self).__init__(True, True, True, map_image, grad)
+            super(InfHardMaze, self).__init__(True, True, True, map_image, grad, verbose=verbose)
@@ -1,14 +1,32 @@
 
 import copy
 import collections
+import time
 from kuimaze.maze import ACTION
 
 import numpy
 
+try:
+	import scipy.sparse
+	import scipy.sparse.linalg
+except ImportError:
+	# Sparse policy evaluation is not available, policy iteration falls back to dense matrices
+	scipy = None
+
+# Relative tolerance of the iterative solver used to evaluate policies
+SOLVER_TOLERANCE = 1e-10
+# Maximal number of iterations of the iterative solver before falling back to a direct sparse solve
+SOLVER_MAX_ITERATIONS = 50
+# A policy is changed only if the new action is better by more than this margin. The values are obtained
+# by an iterative solver, so a strict comparison could keep switching between two (almost) equally good actions
+IMPROVEMENT_TOLERANCE = 1e-9
+
 # Named tuples taken from kuimaze.maze.py and renamed to avoid name ambiguity and clash with 
 # commonly used variable name 'state'
 coord_reward = collections.namedtuple('State', ['x', 'y', 'reward'])
 coord = collections.namedtuple('State', ['x', 'y'])
+# Report of a solver run - number of iterations (sweeps or policy updates), number of backups of single state values and wall time in seconds
+solver_stats = collections.namedtuple('SolverStats', ['iterations', 'backups', 'time'])
 
 
 def expected_value(state_probs, state_values):
@@ -22,8 +40,50 @@ def get_expected_Q_values(problem, state, state_values):
 	action_values = {action : expected_value(children[action], state_values) for action in children}
 	return action_values
 
-def find_policy_via_value_iteration(problem, discount_factor, epsilon):
+def get_Q_value_table(model, state_values):
+	# Vectorized counterpart of get_expected_Q_values - computes expected values of all actions in all states at once.
+	# Values of the outcomes are gathered into an array [S, A, K] and weighted by their probabilities
+	return (model.prob * state_values[model.next_state_index]).sum(axis=2)
+
+
+def extract_policy(model, state_values):
+	# Greedy policy with respect to given state values in the format used by find_policy_via_value_iteration
+	best_actions = get_Q_value_table(model, state_values).argmax(axis=1)
+	actions = list(ACTION)
+	return {
+		coord(state.x, state.y) : None if model.terminal[index] else actions[best_actions[index]]
+		for index, state in enumerate(model.states)}
+
+
+def find_policy_via_vectorized_value_iteration(problem, discount_factor, epsilon):
+	''' Performs value iteration on arrays obtained from problem.get_transition_model(). Each sweep is a single Bellman backup of the whole grid.
+	Returns tuple (policy, solver_stats)'''
+	start_time = time.perf_counter()
+	model = problem.get_transition_model()
+	nonterminal_count = int(numpy.count_nonzero(~model.terminal))
+
+	# Same initialization and stopping rule as in the dictionary based version. Terminals keep their rewards,
+	# the other states start from 0 and the first comparison is made against -1
+	values_new = numpy.where(model.terminal, model.reward, 0.0)
+	values_old = numpy.where(model.terminal, model.reward, -1.0)
+
+	iterations = 0
+	while numpy.any(numpy.abs(values_old - values_new) >= epsilon):
+		values_old = values_new
+		expected_Q_values = get_Q_value_table(model, values_old)
+		values_new = numpy.where(model.terminal, model.reward, model.reward + discount_factor * expected_Q_values.max(axis=1))
+		iterations += 1
+
+	# Construct the policy in the same format as the dictionary based version does
+	policy = extract_policy(model, values_new)
+	return policy, solver_stats(iterations, iterations * nonterminal_count, time.perf_counter() - start_time)
+
+
+def find_policy_via_value_iteration(problem, discount_factor, epsilon, vectorized=True):
 	''' Performs value iteration algorithm on assigned problem to find a suitable policy with highest expected value'''
+	if vectorized:
+		policy, _ = find_policy_via_vectorized_value_iteration(problem, discount_factor, epsilon)
+		return policy
 
 	#dictionary of named tuples representing states (named coordinates to avoid name clash) to state rewards
 	all_states = {coord(state.x, state.y) : state.reward for state in problem.get_all_states()}
@@ -65,6 +125,123 @@ def find_policy_via_value_iteration(problem, discount_factor, epsilon):
 
 	return policy
 
+
+def find_policy_via_gauss_seidel_value_iteration(problem, discount_factor, epsilon):
+	''' Performs in-place (Gauss-Seidel) value iteration. Returns tuple (policy, solver_stats)'''
+	start_time = time.perf_counter()
+	model = problem.get_transition_model()
+
+	# In a 4-neighbourhood, a state only depends on itself and on states of the other colour of a chessboard.
+	# Updating all "black" states at once and then all "white" states using the fresh black values is therefore
+	# the same as sweeping the states one by one in a suitable order, yet it can be done with arrays.
+	colours = numpy.array([(state.x + state.y) % 2 for state in model.states], dtype=int)
+	groups = [numpy.flatnonzero((colours == colour) & ~model.terminal) for colour in (0, 1)]
+
+	values = numpy.where(model.terminal, model.reward, 0.0)
+	iterations = 0
+	backups = 0
+	while True:
+		largest_change = 0.0
+		for group in groups:
+			expected_Q_values = (model.prob[group] * values[model.next_state_index[group]]).sum(axis=2)
+			updated = model.reward[group] + discount_factor * expected_Q_values.max(axis=1)
+			if len(group) > 0:
+				largest_change = max(largest_change, numpy.abs(updated - values[group]).max())
+			values[group] = updated
+			backups += len(group)
+		iterations += 1
+		if largest_change < epsilon:
+			break
+
+	return extract_policy(model, values), solver_stats(iterations, backups, time.perf_counter() - start_time)
+
+
+def find_policy_via_modified_policy_iteration(problem, discount_factor, epsilon, evaluation_sweeps=10):
+	''' Performs modified policy iteration - the policy is evaluated only approximately by 'evaluation_sweeps' sweeps
+	of the fixed-policy Bellman update. Returns tuple (policy, solver_stats)'''
+	start_time = time.perf_counter()
+	model = problem.get_transition_model()
+	indices = numpy.arange(len(model.states))
+	nonterminal_count = int(numpy.count_nonzero(~model.terminal))
+
+	values = numpy.where(model.terminal, model.reward, 0.0)
+	iterations = 0
+	backups = 0
+	while True:
+		# Policy improvement together with a single full Bellman backup, which also serves as the stopping test
+		expected_Q_values = get_Q_value_table(model, values)
+		policy = expected_Q_values.argmax(axis=1)
+		updated = numpy.where(model.terminal, model.reward, model.reward + discount_factor * expected_Q_values[indices, policy])
+		backups += nonterminal_count
+		iterations += 1
+		if numpy.all(numpy.abs(updated - values) < epsilon):
+			values = updated
+			break
+		values = updated
+
+		# Partial policy evaluation. Only the outcomes of the actions dictated by the policy are needed
+		next_state_index = model.next_state_index[indices, policy]
+		prob = model.prob[indices, policy]
+		for _ in range(evaluation_sweeps):
+			values = numpy.where(model.terminal, model.reward, model.reward + discount_factor * (prob * values[next_state_index]).sum(axis=1))
+		backups += evaluation_sweeps * nonterminal_count
+
+	return extract_policy(model, values), solver_stats(iterations, backups, time.perf_counter() - start_time)
+
+
+def find_policy_via_prioritized_sweeping(problem, discount_factor, epsilon, priority_fraction=0.0):
+	''' Performs asynchronous value iteration driven by Bellman residuals. Every sweep backs up only the states with the
+	largest residuals - at least 'priority_fraction' of the largest one. States whose residual is certainly below epsilon
+	are not backed up at all, which saves the work on already converged parts of the maze. Fractions close to one
+	mean fewer backups but many more (tiny) sweeps. Returns tuple (policy, solver_stats)'''
+	start_time = time.perf_counter()
+	model = problem.get_transition_model()
+	state_count, action_count, outcome_count = model.prob.shape
+
+	# When the value of a state changes by delta, the residual of its predecessor can grow by at most
+	# discount_factor * delta * (the largest probability of reaching the state by a single action of the predecessor).
+	# Gather those weights for all pairs (predecessor, state). Pairs are identified by a single number to make grouping simple
+	action_ids = numpy.repeat(numpy.arange(state_count * action_count), outcome_count)
+	# probabilities of outcomes of a single action leading to the same state are summed first ...
+	unique_ids, inverse = numpy.unique(action_ids * state_count + model.next_state_index.ravel(), return_inverse=True)
+	action_probs = numpy.bincount(inverse.ravel(), weights=model.prob.ravel())
+	action_pair_ids = (unique_ids // state_count // action_count) * state_count + unique_ids % state_count
+	# ... and then the largest one over actions is taken
+	order = numpy.argsort(action_pair_ids, kind='stable')
+	action_pair_ids, action_probs = action_pair_ids[order], action_probs[order]
+	pair_ids, starts = numpy.unique(action_pair_ids, return_index=True)
+	weights = discount_factor * numpy.maximum.reduceat(action_probs, starts)
+	pair_predecessors = pair_ids // state_count
+	pair_states = pair_ids % state_count
+
+	values = numpy.where(model.terminal, model.reward, 0.0)
+	residuals = numpy.where(model.terminal, 0.0, numpy.abs(model.reward + discount_factor * get_Q_value_table(model, values).max(axis=1) - values))
+
+	iterations = 0
+	backups = 0
+	while True:
+		largest_residual = residuals.max()
+		if largest_residual < epsilon:
+			break
+		selected = numpy.flatnonzero(residuals >= max(epsilon, priority_fraction * largest_residual))
+
+		expected_Q_values = (model.prob[selected] * values[model.next_state_index[selected]]).sum(axis=2)
+		updated = model.reward[selected] + discount_factor * expected_Q_values.max(axis=1)
+		deltas = numpy.zeros(state_count)
+		deltas[selected] = numpy.abs(updated - values[selected])
+		values[selected] = updated
+		iterations += 1
+		backups += len(selected)
+
+		# Backed up states have zero residual with respect to the values they were computed from. Then bound
+		# the residuals of all predecessors of the changed states
+		residuals[selected] = 0.0
+		residuals += numpy.bincount(pair_predecessors, weights=weights * deltas[pair_states], minlength=state_count)
+		residuals[model.terminal] = 0.0
+
+	return extract_policy(model, values), solver_stats(iterations, backups, time.perf_counter() - start_time)
+
+
 def compute_matrix_row_for(problem, all_states, state, next_action, state_index, discount_factor):
 	# Returns a line for the matrix A corresponding to state 'state'
 	if problem.is_terminal_state(state):
@@ -83,8 +260,66 @@ def compute_matrix_row_for(problem, all_states, state, next_action, state_index,
 	return row
 
 
-def find_policy_via_policy_iteration(problem, discount_factor):
+def evaluate_policy_sparse(A, B, initial_values):
+	# Solves the system A * values = B describing values of states under a fixed policy. The solution for the previous
+	# policy is usually very close, hence it is used as the initial guess of the iterative solver
+	values, info = scipy.sparse.linalg.bicgstab(A, B, x0=initial_values, rtol=SOLVER_TOLERANCE, atol=0, maxiter=SOLVER_MAX_ITERATIONS)
+	if info != 0:
+		# The iterative solver has not converged (e.g. for discount factor very close to one). Use direct solver instead
+		values = scipy.sparse.linalg.spsolve(A.tocsc(), B)
+	return values
+
+
+def find_policy_via_sparse_policy_iteration(problem, discount_factor, epsilon=None):
+	''' Performs policy iteration on arrays obtained from problem.get_transition_model(). Policies are evaluated by solving sparse systems of linear equations.
+	Parameter epsilon is not used, it is present only for the interface to be the same as for the other solvers. Returns tuple (policy, solver_stats)'''
+	start_time = time.perf_counter()
+	model = problem.get_transition_model()
+	state_count, action_count, outcome_count = model.prob.shape
+	indices = numpy.arange(state_count)
+	policy = numpy.full(state_count, ACTION.UP.value) # initializes policy to some "random" direction
+
+	# The matrix A = I - discount_factor * P, where P holds transition probabilities under the current policy.
+	# Each row has at most outcome_count nonzeros, which are stored in arrays [S, K] and updated only for the states
+	# whose action changes. Terminal states keep zero rows in P, their value is fixed by the reward.
+	rows = numpy.repeat(indices, outcome_count)
+	columns = model.next_state_index[indices, policy]
+	probs = numpy.where(model.terminal[:, numpy.newaxis], 0.0, model.prob[indices, policy])
+	identity = scipy.sparse.identity(state_count, format='csr')
+
+	# Column of right hand sides stays constant over the course of the algorithm
+	B = model.reward
+	state_values = B.copy()
+
+	iterations = 0
+	while True:
+		iterations += 1
+		P = scipy.sparse.csr_matrix((probs.ravel(), (rows, columns.ravel())), shape=(state_count, state_count))
+		state_values = evaluate_policy_sparse(identity - discount_factor * P, B, state_values)
+
+		# Refine the policy based on new information about state values
+		Q_values = get_Q_value_table(model, state_values)
+		best_actions = Q_values.argmax(axis=1)
+		changed = Q_values[indices, best_actions] > Q_values[indices, policy] + IMPROVEMENT_TOLERANCE
+		if not changed.any():
+			break
+
+		# Update the policy as well as rows of matrix A for the states that got a better action
+		policy[changed] = best_actions[changed]
+		columns[changed] = model.next_state_index[changed, best_actions[changed]]
+		probs[changed] = numpy.where(model.terminal[changed, numpy.newaxis], 0.0, model.prob[changed, best_actions[changed]])
+
+	actions = list(ACTION)
+	policy = {coord(state.x, state.y) : actions[policy[index]] for index, state in enumerate(model.states)}
+	# Each iteration evaluates the policy exactly and then backs up every state once during the improvement
+	return policy, solver_stats(iterations, iterations * state_count, time.perf_counter() - start_time)
+
+
+def find_policy_via_policy_iteration(problem, discount_factor, sparse=True):
 	''' Performs policy iteration on assigned problem to find a suitable policy with highest expected value'''
+	if sparse and scipy is not None:
+		policy, _ = find_policy_via_sparse_policy_iteration(problem, discount_factor)
+		return policy
 	all_states = {coord(state.x, state.y) : state.reward for state in problem.get_all_states()}
 	policy = {state : ACTION.UP for state in all_states} # initializes policy to some "random" direction
 
@@ -127,3 +362,21 @@ def find_policy_via_policy_iteration(problem, discount_factor):
 
 	return policy
 
+
+# Solvers working on the transition model, all of them share the interface
+# solver(problem, discount_factor, epsilon, **options) -> (policy, solver_stats)
+SOLVERS = {
+	'value_iteration' : find_policy_via_vectorized_value_iteration,
+	'gauss_seidel' : find_policy_via_gauss_seidel_value_iteration,
+	'modified_policy_iteration' : find_policy_via_modified_policy_iteration,
+	'prioritized_sweeping' : find_policy_via_prioritized_sweeping,
+}
+if scipy is not None:
+	SOLVERS['policy_iteration'] = find_policy_via_sparse_policy_iteration
+
+
+def solve(problem, discount_factor, epsilon, method='value_iteration', **options):
+	''' Finds a policy by the solver selected by its name from SOLVERS. Returns tuple (policy, solver_stats)'''
+	if method not in SOLVERS:
+		raise ValueError('Unknown solver {}, available solvers are {}'.format(method, ', '.join(SOLVERS)))
+	return SOLVERS[method](problem, discount_factor, epsilon, **options)
@@ -14,6 +14,7 @@ from .gym_wrapper import MDPMaze
 from .gym_wrapper import HardMaze
 from .gym_wrapper import InfHardMaze
 from .gym_wrapper import EasyMazeEnv
+from .gym_wrapper import VectorHardMaze
 
 __all__ = ['Maze', 'SHOW', 'ACTION', 'SearchAgent','BaseAgent', 'ProbsRoulet']
 
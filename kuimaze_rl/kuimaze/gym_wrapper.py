@@ -26,9 +26,10 @@ class MazeEnv(gym.Env):
     metadata = {'render.modes': ['human']}
     _path = []
     _visited = []
+    _visited_grid = None
     MAP = '../maps/easy/easy3.bmp'
 
-    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None):
+    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None, verbose=False):
         '''
         Class wrapping Maze into gym enviroment.
         @param informed: boolean
@@ -36,6 +37,7 @@ class MazeEnv(gym.Env):
         @param deter: boolean - T = deterministic maze, F = probabilistic maze
         @param map_image_dir: string - path to image of map
         @param grad: tuple - vector tuning the tilt of maze`
+        @param verbose: boolean - T = print diagnostic messages of the maze to stdout
         '''
         if map_image_dir is None:
             '''
@@ -52,7 +54,7 @@ class MazeEnv(gym.Env):
             self._grad = (0, 0)
         else:
             self._grad = grad
-        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards)
+        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards, verbose=verbose)
         self._player = EnvAgent(self._problem)
         self._curr_state = self._problem.get_start_state()
         self._informed = informed
@@ -76,8 +78,7 @@ class MazeEnv(gym.Env):
             action = self._problem.non_det_result(action)
         self._curr_state = self._problem.result(self._curr_state, action)
         self._path.append(self._curr_state)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._mark_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         # reward = self._problem.get_state_reward(self._curr_state)
         return self._get_observation(), reward, done, None
@@ -94,14 +95,35 @@ class MazeEnv(gym.Env):
         self._gui_disabled = True
         self._path = []
         self._visited = []
+        self._visited_grid = np.zeros((self._xsize, self._ysize), dtype=bool)
         self._problem.clear_player_data()
         self._problem.set_player(self._player)
         if self._gym_compatible:
             self._path.append(self._problem.get_start_state())
-        self._visited.append(self._problem.get_start_state())
+        self._mark_visited(self._problem.get_start_state())
         self._curr_state = self._problem.get_start_state()
         return self._get_observation()
 
+    def _mark_visited(self, new_state):
+        '''
+        Records the state as visited. Visited states are kept in a boolean grid for constant time lookup
+        and in a list ordered by the time of the first visit, which is used for rendering.
+        @param new_state: namedtuple state
+        @return: None
+        '''
+        if not self._visited_grid[new_state.x, new_state.y]:
+            self._visited_grid[new_state.x, new_state.y] = True
+            self._visited.append(new_state)
+
+    def _is_visited(self, new_state):
+        '''
+        returns true if the state has already been visited
+        @param new_state: namedtuple state
+        @return: boolean
+        '''
+        return 0 <= new_state.x < self._xsize and 0 <= new_state.y < self._ysize and \
+            bool(self._visited_grid[new_state.x, new_state.y])
+
     def render(self, mode='human', close=False, visited=None, explored=None):
         assert self._set, "reset() must be called first!"
         self._gui_disabled = False
@@ -254,16 +276,15 @@ class EasyMazeEnv(MazeEnv):
     Unlike the HardMaze, EasyMaze has additional method set_path - which can set different path than agent movement.
     '''
 
-    def __init__(self, informed, map_image_dir=None, grad=(0, 0)):
-        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad)
+    def __init__(self, informed, map_image_dir=None, grad=(0, 0), verbose=False):
+        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad, verbose=verbose)
         self._gui_on = False
 
     def step(self, action):
         last_state = self._curr_state
         assert (type(action) == list or type(action) == tuple) and len(action) == 2
         self._curr_state = self._easy_result(action)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._mark_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         return self._get_observation(), reward, done, None
 
@@ -298,11 +319,9 @@ class EasyMazeEnv(MazeEnv):
         @param new_state:
         @return: boolean
         '''
-        tmp = []
-        tmp.extend(self._visited)
-        tmp.extend([self._problem.result(self._curr_state, 0), self._problem.result(self._curr_state, 1),
-                    self._problem.result(self._curr_state, 2), self._problem.result(self._curr_state, 3)])
-        return new_state in tmp
+        if self._is_visited(new_state):
+            return True
+        return any(new_state == self._problem.result(self._curr_state, action) for action in range(4))
 
     def _easy_result(self, state_list):
         '''
@@ -350,8 +369,7 @@ class EasyMazeEnv(MazeEnv):
         for new_state in tmp: 
             if new_state.x == maze_pose.x and new_state.y == maze_pose.y:
                 continue
-            if new_state not in self._visited:
-                self._visited.append(new_state)
+            self._mark_visited(new_state)
             reward = self._get_cost(maze_pose, new_state)
             expanded_nodes.append([(new_state.x, new_state.y), reward])
         return expanded_nodes
@@ -386,8 +404,8 @@ class InfEasyMaze(EasyMazeEnv):
     informed easy maze, suitable for A* implementation
     step([x, y])
     '''
-    def __init__(self, map_image=None, grad=(0, 0)):
-        super(InfEasyMaze, self).__init__(True, map_image, grad)
+    def __init__(self, map_image=None, grad=(0, 0), verbose=False):
+        super(InfEasyMaze, self).__init__(True, map_image, grad, verbose=verbose)
 
 
 class EasyMaze(EasyMazeEnv):
@@ -395,20 +413,20 @@ class EasyMaze(EasyMazeEnv):
     uninformed easy maze, suitable for BFS, DFS ...
     step([x, y])
     '''
-    def __init__(self, map_image=None, grad=(0, 0)):
-        super(EasyMaze, self).__init__(False, map_image, grad)
+    def __init__(self, map_image=None, grad=(0, 0), verbose=False):
+        super(EasyMaze, self).__init__(False, map_image, grad, verbose=verbose)
 
 
 class MDPMaze(MazeEnv):
     '''
     maze for solving MDP problems
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
         if probs is not None:
-            super().__init__(False, True, False, map_image, grad, node_rewards=node_rewards)
+            super().__init__(False, True, False, map_image, grad, node_rewards=node_rewards, verbose=verbose)
             self._problem.set_probs_table(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super().__init__(False, True, True, map_image, grad)
+            super().__init__(False, True, True, map_image, grad, verbose=verbose)
 
     def _get_reward(self, curr, last):
         '''
@@ -452,12 +470,12 @@ class HardMaze(MazeEnv):
     Uninformed hard maze, suitable for reinforcement learning
     step(param) where param is integer; 0 <= param <= 3
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
         if probs is not None:
-            super(HardMaze, self).__init__(False, True, False, map_image, grad, node_rewards=node_rewards)
+            super(HardMaze, self).__init__(False, True, False, map_image, grad, node_rewards=node_rewards, verbose=verbose)
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super(HardMaze, self).__init__(False, True, True, map_image, grad)
+            super(HardMaze, self).__init__(False, True, True, map_image, grad, verbose=verbose)
 
     def _get_reward(self, curr, last):
         '''
@@ -480,14 +498,125 @@ class HardMaze(MazeEnv):
                 self._player.find_path()
         return reward, done
 
+    def get_settings(self):
+        '''
+        Returns the arguments creating an equal maze, e.g. HardMaze(*env.get_settings()) in another process
+        or VectorHardMaze(num_envs, *env.get_settings())
+        @return: tuple (map_image, grad, probs, node_rewards), probs and node_rewards are None for a deterministic maze
+        '''
+        if self._deter:
+            return self.MAP, self._grad, None, None
+        # Maze transposes the rewards given as an array, so they are given back transposed
+        return self.MAP, self._grad, self._problem.get_probs(), self._problem.get_node_rewards().T
+
 class InfHardMaze(MazeEnv):
     '''
     Informed hard maze, suitable for reinforcement learning
     step(param) where param is integer; 0 <= param <= 3
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, verbose=False):
         if probs is not None:
-            super(InfHardMaze, self).__init__(True, True, False, map_image, grad)
+            super(InfHardMaze, self).__init__(True, True, False, map_image, grad, verbose=verbose)
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super(InfHardMaze, self).__init__(True, True, True, map_image, grad)
+            super(InfHardMaze, self).__init__(True, True, True, map_image, grad, verbose=verbose)
+
+
+class VectorHardMaze:
+    '''
+    Batch of independent uninformed hard mazes over the same map, stepped all at once.
+    Agent i behaves like its own HardMaze - it starts in the start state, its actions are confused with the same
+    probabilities and it gets the same rewards, but positions, rewards and dones of all agents are numpy arrays.
+    Paths and visited states are not recorded, hence there is no rendering.
+    step(actions) where actions is an integer array of length num_envs; 0 <= action <= 3
+    A batch equal to an existing HardMaze is created by VectorHardMaze(num_envs, *env.get_settings()).
+    '''
+
+    def __init__(self, num_envs, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
+        '''
+        @param num_envs: integer - number of agents stepped together
+        @param map_image: string - path to image of map, random map is generated if None
+        @param grad: tuple - vector tuning the tilt of maze
+        @param probs: tuple (obey, confusionL, confusionR, confusion180) or None for deterministic maze
+        @param node_rewards: rewards of cells, see L{kuimaze.Maze}
+        @param verbose: boolean - T = print diagnostic messages of the maze to stdout
+        '''
+        assert num_envs > 0
+        self._env = HardMaze(map_image, grad, probs, node_rewards, verbose=verbose)
+        problem = self._env._problem
+        self.num_envs = num_envs
+        self.action_space = self._env.action_space
+        self.observation_space = self._env.observation_space
+        self._grad = np.array(self._env._grad, dtype=float)
+        self._passable = problem.get_passable_grid()
+        self._node_rewards = problem.get_node_rewards()
+        self._goals = np.zeros(self._passable.shape, dtype=bool)
+        for goal in problem.get_goal_nodes():
+            self._goals[goal.x, goal.y] = True
+        self._deltas = np.array(problem.get_action_deltas(), dtype=int)
+        start = problem.get_start_state()
+        self._start = np.array([start.x, start.y], dtype=int)
+        if probs is None:
+            self._thresholds = None
+        else:
+            # roulette wheel of ProbsRoulette - no change, confused left, confused right, confused back
+            self._thresholds = np.cumsum(probs[:3])
+            self._confusions = np.array([0, -1, 1, 2], dtype=int)
+        self._positions = np.tile(self._start, (num_envs, 1))
+        self.seed()
+
+    @property
+    def positions(self):
+        '''
+        Current positions of all agents as integer array of shape (num_envs, 2), rows are [x, y]
+        '''
+        return self._positions.copy()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def reset(self, mask=None):
+        '''
+        Moves agents back to the start state
+        @param mask: boolean array of length num_envs selecting agents to reset, None for all of them
+        @return: observations of all agents, see L{step}
+        '''
+        if mask is None:
+            self._positions[:] = self._start
+        else:
+            self._positions[np.asarray(mask, dtype=bool)] = self._start
+        return self._get_observations()
+
+    def step(self, actions):
+        '''
+        Performs one action of every agent
+        @param actions: integer array of length num_envs
+        @return: observations - float array of shape (num_envs, 3) with rows [x, y, depth] like the observation of HardMaze,
+        rewards - float array of length num_envs, dones - boolean array of length num_envs, None
+        '''
+        actions = np.asarray(actions, dtype=int)
+        assert actions.shape == (self.num_envs,)
+        assert ((0 <= actions) & (actions <= 3)).all()
+        if self._thresholds is not None:
+            confusion = np.searchsorted(self._thresholds, self.np_random.random(self.num_envs), side='right')
+            actions = (actions + self._confusions[confusion]) % 4
+        last = self._positions
+        target = last + self._deltas[actions]
+        inside = (target >= 0).all(axis=1) & (target[:, 0] < self._passable.shape[0]) & (target[:, 1] < self._passable.shape[1])
+        moved = inside.copy()
+        moved[inside] = self._passable[target[inside, 0], target[inside, 1]]
+        curr = np.where(moved[:, np.newaxis], target, last)
+        # the same formula as HardMaze._get_reward
+        rewards = self._node_rewards[last[:, 0], last[:, 1]].copy()
+        rewards[moved] -= (curr[moved] - last[moved]) @ self._grad
+        dones = self._goals[curr[:, 0], curr[:, 1]]
+        rewards[dones] += self._node_rewards[curr[dones, 0], curr[dones, 1]]
+        self._positions = curr
+        return self._get_observations(), rewards, dones, None
+
+    def _get_observations(self):
+        observations = np.empty((self.num_envs, 3), dtype=float)
+        observations[:, :2] = self._positions
+        observations[:, 2] = np.round((self._positions - self._start) @ self._grad, 3)
+        return observations
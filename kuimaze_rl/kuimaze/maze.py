@@ -9,6 +9,8 @@ Main part of kuimaze - framework for working with mazes. Contains class Maze (ca
 '''
 
 import collections
+import hashlib
+import logging
 import enum
 import numpy as np
 import os
@@ -21,6 +23,16 @@ import tkinter
 
 import kuimaze
 
+#: Logger for diagnostic messages of kuimaze. Quiet by default, see L{set_verbose}
+logger = logging.getLogger(__name__)
+_verbose_handler = logging.StreamHandler(sys.stdout)
+#: Logger of mazes created with verbose=True. Always prints to stdout, so that a single verbose maze
+#: does not need to change the level of L{logger} for the whole process
+verbose_logger = logging.getLogger(__name__ + '.verbose')
+verbose_logger.addHandler(logging.StreamHandler(sys.stdout))
+verbose_logger.setLevel(logging.DEBUG)
+verbose_logger.propagate = False
+
 # nicer warnings
 fw_orig = warnings.formatwarning
 warnings.formatwarning = lambda msg, categ, fname, lineno, line=None: fw_orig(msg, categ, fname, lineno, '')
@@ -32,6 +44,8 @@ weighted_state = collections.namedtuple('State', ['x', 'y', 'reward'])
 state = collections.namedtuple('State', ['x', 'y'])
 #: Namedtuple to hold path_section from state A to state B. Expects C{state_from} and C{state_to} to be of type L{state} or L{weighted_state}
 path_section = collections.namedtuple('Path', ['state_from', 'state_to', 'cost', 'action'])
+#: Namedtuple holding the result of parsing a maze image. C{maze} is the boolean grid (True = free) indexed as [x, y], C{finish} does not contain hard places.
+parsed_maze = collections.namedtuple('ParsedMaze', ['maze', 'start', 'finish', 'hard_places', 'node_rewards'])
 
 # constants used for GUI drawing
 #: Maximum size of one cell in GUI in pixels. If problem is too large to fit on screen, the cell size will be smaller
@@ -66,6 +80,12 @@ REWARD_NORMAL = -0.04 # e.g. energy consumption
 REWARD_DANGER = -1
 REWARD_GOAL = 1
 
+#: Number of parsed mazes kept in memory, see L{load_maze}
+MAZE_CACHE_SIZE = 32
+#: Whether parsed mazes are also stored on disk next to the image as C{<image>.npz}
+MAZE_CACHE_SIDECAR = False
+_maze_cache = collections.OrderedDict()
+
 class SHOW(enum.Enum):
     '''
     Enum class used for storing what is displayed in GUI - everything higher includes everything lower (except NONE, of course).
@@ -114,10 +134,17 @@ class ProbsRoulette:
         assert 0 <= confusionL <= 1
         assert 0 <= confusionR <= 1
         assert 0 <= confusion180 <= 1
+        self._probs = (obey, confusionL, confusionR, confusion180)
         self._obey = obey
         self._confusionLeft = self._obey + confusionL
         self._confusionRight = self._confusionLeft + confusionR
 
+    def get_probs(self):
+        '''
+        @return: tuple (obey, confusionL, confusionR, confusion180) as given to L{set_probs}
+        '''
+        return self._probs
+
     def confuse_action(self, action):
         roulette = random.uniform(0.0, 1.0)
         if 0 <= roulette < self._obey:
@@ -168,10 +195,154 @@ class ActionProbsTable:
     def __getitem__(self, item):
         return self.probtable[item]
 
+    def get_probs(self):
+        '''
+        @return: tuple (obey, confusionL, confusionR, confusion180) as given to the constructor
+        '''
+        return (self.probtable[ACTION.UP, ACTION.UP], self.probtable[ACTION.UP, ACTION.LEFT],
+                self.probtable[ACTION.UP, ACTION.RIGHT], self.probtable[ACTION.UP, ACTION.DOWN])
+
     def __str__(self):
         return str(self.probtable)
 
 
+def set_verbose(verbose=True):
+    '''
+    Switches printing of diagnostic messages of kuimaze to stdout on or off.
+    While switched off (and logging not configured otherwise) the messages are not even formatted.
+    @param verbose: bool
+    '''
+    if verbose:
+        if _verbose_handler not in logger.handlers:
+            logger.addHandler(_verbose_handler)
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.removeHandler(_verbose_handler)
+        logger.setLevel(logging.NOTSET)
+
+
+def default_node_rewards(shape, finish, hard_places):
+    '''
+    Builds the default reward grid - REWARD_NORMAL everywhere, REWARD_GOAL in goals and REWARD_DANGER in hard places.
+    @param shape: shape of the maze grid, (xsize, ysize)
+    @param finish: iterable of goal states
+    @param hard_places: iterable of dangerous states
+    @return: numpy array of shape C{shape} indexed as [x, y]
+    '''
+    node_rewards = np.full(shape, REWARD_NORMAL, dtype=float)
+    for pos in finish:
+        node_rewards[pos.x, pos.y] = REWARD_GOAL
+    for pos in hard_places:
+        node_rewards[pos.x, pos.y] = REWARD_DANGER
+    return node_rewards
+
+
+def parse_maze_image(image):
+    '''
+    Parses an RGB image of the maze - blue pixel is the start, red pixels are goals, green pixels are hard places
+    and black pixels are walls.
+    @param image: path to the image or the image data itself (anything accepted by np.array)
+    @return: L{namedtuple parsed_maze<parsed_maze>}. Hard places are not included in C{finish}.
+    @raise AssertionError: When image is not RGB image.
+    '''
+    try:
+        im_data = Image.open(image)
+    except:
+        im_data = image
+    maze = np.array(im_data, dtype=int)
+    assert (len(maze.shape) == 3 and maze.shape[2] == 3)
+    grid = maze.sum(axis=2, dtype=bool).T
+    # masks are indexed as [y, x] like the image, argwhere() then yields pixels row by row
+    finish_mask = (maze == [255, 0, 0]).all(axis=-1)
+    start_mask = (maze == [0, 0, 255]).all(axis=-1)
+    hard_mask = (maze == [0, 255, 0]).all(axis=-1)
+    starts = [state(x, y) for y, x in np.argwhere(start_mask).tolist()]
+    start = starts[-1] if starts else None
+    finish = [state(x, y) for y, x in np.argwhere(finish_mask).tolist()]
+    hard_places = [state(x, y) for y, x in np.argwhere(hard_mask).tolist()]
+    node_rewards = np.full(grid.shape, REWARD_NORMAL, dtype=float)
+    node_rewards[(finish_mask | hard_mask).T] = REWARD_GOAL
+    node_rewards[hard_mask.T] = REWARD_DANGER
+    grid.flags.writeable = False
+    node_rewards.flags.writeable = False
+    return parsed_maze(grid, start, frozenset(finish), tuple(hard_places), node_rewards)
+
+
+def maze_digest(image):
+    '''
+    Content hash of the maze image - of the file bytes if a path is given, of the pixel data otherwise.
+    '''
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    data = np.ascontiguousarray(np.array(image, dtype=int))
+    digest = hashlib.sha1(data.tobytes())
+    digest.update(str(data.shape).encode())
+    return digest.hexdigest()
+
+
+def _load_sidecar(path, digest):
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['digest']) != digest:
+                return None
+            start = state(*data['start'].tolist()) if data['start'].size else None
+            finish = frozenset(state(*pos) for pos in data['finish'].tolist())
+            hard_places = tuple(state(*pos) for pos in data['hard_places'].tolist())
+            grid = data['maze']
+            node_rewards = data['node_rewards']
+    except (OSError, KeyError, ValueError):
+        return None
+    grid.flags.writeable = False
+    node_rewards.flags.writeable = False
+    return parsed_maze(grid, start, finish, hard_places, node_rewards)
+
+
+def _save_sidecar(path, digest, parsed):
+    try:
+        np.savez(path, digest=np.array(digest),
+                 maze=parsed.maze,
+                 start=np.array([] if parsed.start is None else list(parsed.start), dtype=int),
+                 finish=np.array(sorted(parsed.finish), dtype=int).reshape(-1, 2),
+                 hard_places=np.array(parsed.hard_places, dtype=int).reshape(-1, 2),
+                 node_rewards=parsed.node_rewards)
+    except OSError as e:
+        warnings.warn('Cannot write maze cache {}: {}'.format(path, e))
+
+
+def load_maze(image):
+    '''
+    Returns the parsed maze, reusing the result of previous parsing of the same content if possible.
+    Parsed mazes are kept in memory in a LRU cache of size L{MAZE_CACHE_SIZE}. If L{MAZE_CACHE_SIDECAR} is set and image
+    is a path, the parsed maze is also stored next to the image as C{<image>.npz} and loaded from there next time.
+    Arrays of the returned maze are shared between callers and thus read-only.
+    @param image: path to the image or the image data itself
+    @return: L{namedtuple parsed_maze<parsed_maze>}
+    '''
+    digest = maze_digest(image)
+    parsed = _maze_cache.get(digest)
+    if parsed is not None:
+        _maze_cache.move_to_end(digest)
+        return parsed
+    sidecar = None
+    if MAZE_CACHE_SIDECAR and isinstance(image, (str, os.PathLike)):
+        sidecar = os.fspath(image) + '.npz'
+        parsed = _load_sidecar(sidecar, digest)
+    if parsed is None:
+        parsed = parse_maze_image(image)
+        if sidecar is not None:
+            _save_sidecar(sidecar, digest, parsed)
+    _maze_cache[digest] = parsed
+    while len(_maze_cache) > MAZE_CACHE_SIZE:
+        _maze_cache.popitem(last=False)
+    return parsed
+
+
+def clear_maze_cache():
+    '''
+    Drops all parsed mazes from the in-memory cache.
+    '''
+    _maze_cache.clear()
 
 
 class Maze:
@@ -182,7 +353,7 @@ class Maze:
     __ACTIONS = [ACTION.UP, ACTION.RIGHT, ACTION.DOWN, ACTION.LEFT]
 
     def __init__(self, image, grad, node_rewards=None, path_costs=None, trans_probs=None, show_level=SHOW.FULL_MAZE,
-                 start_node=None, goal_nodes=None, ):
+                 start_node=None, goal_nodes=None, hard_places_are_goals=True, verbose=False):
         '''
         Parameters node_rewards, path_costs and trans_probs are meant for defining more complicated mazes. Parameter start_node redefines start state completely, parameter goal_nodes will add nodes to a list of goal nodes.
 
@@ -208,18 +379,17 @@ class Maze:
         @type start_node: L{namedtuple state<state>} or None for default start state loaded from image.
         @keyword goal_nodes: Appending to a list of goal nodes. Must be valid nodes inside a problem without a wall.
         @type goal_nodes: iterable of L{namedtuples state<state>} or None for default set of goal nodes loaded from image.
+        @keyword hard_places_are_goals: Whether hard places loaded from image are also goal nodes. Needed for MDP and RL, but not for the search.
+        @type hard_places_are_goals: bool
+        @keyword verbose: Print diagnostic messages of this maze to stdout. To switch them on for all mazes, see L{set_verbose}.
+        @type verbose: bool
 
         @raise AssertionError: When image is not RGB image or if show is not of type L{kuimaze.SHOW} or if initialization didn't finish correctly.
         '''
-        try:
-            im_data = Image.open(image)
-            self.__filename = image
-        except:
-            im_data = image
-            self.__filename = 'given'
-        maze = np.array(im_data, dtype=int)
-        assert (len(maze.shape) == 3 and maze.shape[2] == 3)
-        self.__maze = maze.sum(axis=2, dtype=bool).T
+        self._logger = verbose_logger if verbose else logger
+        parsed = load_maze(image)
+        self.__filename = image if isinstance(image, (str, os.PathLike)) else 'given'
+        self.__maze = parsed.maze
         self.__start = None
         self.__finish = None
         self.hard_places = []
@@ -244,19 +414,12 @@ class Maze:
 
         self.__has_triangles = False
 
-        maze = maze.tolist()
-        finish = []
         if start_node is None or goal_nodes is None:
-            for y, col in enumerate(maze):
-                for x, cell in enumerate(col):
-                    if cell == [255, 0, 0]:
-                        finish.append(state(x, y))
-                    if cell == [0, 0, 255]:
-                        self.__start = state(x, y)
-                    if cell == [0, 255, 0]:
-                        self.hard_places.append(state(x, y))
-                        finish.append(state(x,y))
-            self.__finish = frozenset(finish)
+            self.__start = parsed.start
+            self.hard_places = list(parsed.hard_places)
+            self.__finish = parsed.finish
+            if hard_places_are_goals:
+                self.__finish = self.__finish.union(self.hard_places)
 
         if start_node is not None:
             if self.__is_inside_valid(start_node):
@@ -278,22 +441,17 @@ class Maze:
             else: # array provided directly
                 node_rewards = np.array(node_rewards)
                 node_rewards = np.transpose(node_rewards)
-            print(node_rewards.shape, self.__maze.shape)
+            self._logger.debug('node rewards shape %s, maze shape %s', node_rewards.shape, self.__maze.shape)
             if node_rewards.shape == self.__maze.shape:
                 self.__node_rewards = node_rewards
-            print(self.__node_rewards)
+            self._logger.debug('node rewards:\n%s', self.__node_rewards)
 
         if self.__node_rewards is None:
-            self.__node_rewards = np.zeros(self.__maze.shape, dtype=float)
-            for y, col in enumerate(maze):
-                for x, cell in enumerate(col):
-                    pos = state(x,y)
-                    self.__node_rewards[x, y] = REWARD_NORMAL # implicit
-                    if pos in self.__finish:
-                        self.__node_rewards[x,y] = REWARD_GOAL
-                    if pos in self.hard_places:
-                        self.__node_rewards[x,y] = REWARD_DANGER
-            print(self.__node_rewards)
+            if goal_nodes is None:
+                self.__node_rewards = parsed.node_rewards
+            else:
+                self.__node_rewards = default_node_rewards(self.__maze.shape, self.__finish, self.hard_places)
+            self._logger.debug('node rewards:\n%s', self.__node_rewards)
 
         if self.__node_utils is None:
             self.__node_utils = np.zeros(self.__maze.shape, dtype=float)
@@ -321,7 +479,7 @@ class Maze:
         assert (self.__node_rewards is not None)
         assert (self.__path_costs is not None)
         assert (self.__trans_probs is not None)
-        print('maze init done')
+        self._logger.debug('maze init done')
 
     def get_state_reward(self, state):
         return self.__node_rewards[state.x, state.y]
@@ -389,6 +547,30 @@ class Maze:
         '''
         return self.__maze.shape
 
+    def get_passable_grid(self):
+        '''
+        Returns a grid marking the cells without a wall
+        @return: boolean array of shape L{get_dimensions()<get_dimensions>}, True where there is no wall, indexed [x, y]
+        @rtype: numpy.ndarray
+        '''
+        return self.__maze.copy()
+
+    def get_node_rewards(self):
+        '''
+        Returns rewards of all cells, the same values as L{get_state_reward}
+        @return: float array of shape L{get_dimensions()<get_dimensions>}, indexed [x, y]
+        @rtype: numpy.ndarray
+        '''
+        return np.array(self.__node_rewards, dtype=float)
+
+    def get_action_deltas(self):
+        '''
+        Returns the change of position caused by each action, indexed by the action number used in L{result}
+        @return: list of [dx, dy] pairs
+        @rtype: list
+        '''
+        return [list(delta) for delta in self.__deltas]
+
     def get_actions(self, current_state):
         '''
         Generate (yield) actions possible for the current_state
@@ -447,6 +629,14 @@ class Maze:
     def set_probs(self, obey, confusionL, confusionR, confusion180):
         self.__trans_probs.set_probs(obey, confusionL, confusionR, confusion180)
 
+    def get_probs(self):
+        '''
+        Returns probabilities of action outcomes
+        @return: tuple (obey, confusionL, confusionR, confusion180)
+        @rtype: tuple
+        '''
+        return self.__trans_probs.get_probs()
+
     def set_probs_table(self, obey, confusionL, confusionR, confusion180):
         self.__trans_probs = ActionProbsTable(obey, confusionL, confusionR, confusion180)
 
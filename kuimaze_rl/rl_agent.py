@@ -8,20 +8,177 @@
 import time
 import itertools
 import random
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
 
 import numpy
 
-def learn_policy(env):
-	# Runs SARSA algorithm on given square grid environment for twenty seconds.
-	# Returns a policy as dictionary mapping state coordinates to actions '(x, y) -> hopefully_optimal_action'
-	# Needs to keep track of elapsed time in order not to be killed by the automati evaluation engine
+import kuimaze
 
-	starting_time = time.time()
+# Wall time in seconds given to a single learning run by the evaluation engine
+MAX_TIME = 20
+# Learning stops this many seconds before MAX_TIME, so that there is time left to build and return the policy
+TIME_MARGIN = 0.25
+# Additional margin in seconds per state of the maze, building the policy dict of a large maze takes a while
+POLICY_TIME_PER_STATE = 5e-7
+# The clock is read roughly this often (in seconds), so learning ends at most this late after the deadline
+DEADLINE_ACCURACY = 0.05
+# Number of steps before the first reading of the clock, when the speed of learning is not known yet
+FIRST_CHECK_STEPS = 100
+# Exploration rate falls from 1 to EPSILON_MIN during the first half of the budget
+EPSILON_MIN = 0.1
+# Learning rate falls linearly from ALPHA_START to ALPHA_END during the budget
+ALPHA_START = 0.1
+ALPHA_END = 0.05
+# Number of agents of the VectorHardMaze stepped together, their transitions are applied to the flat table of Qvalues
+# in a single vectorized update
+BATCH_SIZE = 32
+# Number of the most recent transitions remembered for replay by Dyna-Q planning
+REPLAY_CAPACITY = 100000
+# Decay of eligibility traces (lambda) used by the algorithms 'sarsa_lambda' and 'q_lambda'
+TRACE_DECAY = 0.9
+# Eligibility traces that decay below this value are dropped, so that only a few recent pairs (St, At) stay active
+TRACE_CUTOFF = 1e-3
+# Algorithms selectable in learn_policy
+ALGORITHMS = ('sarsa', 'sarsa_lambda', 'q_lambda')
+# Parallel learning - workers merge their tables of Qvalues every MERGE_INTERVAL seconds. A worker that waits
+# for the others longer than MERGE_TIMEOUT seconds gives up merging, the tables are merged once more at the end anyway
+MERGE_INTERVAL = 1.0
+MERGE_TIMEOUT = 1.0
+# Ways of merging the tables of Qvalues of parallel workers, see merge_Q_tables
+MERGE_METHODS = ('average', 'visits')
+
+
+def get_state_id(state, y_dims):
+	# Index of the state in the flat table of Qvalues
+	return state[0] * y_dims + state[1]
+
+
+class ReplayBuffer:
+	# Ring buffer of observed transitions (St, At, Rt+1, St+1). States are stored as state ids (see get_state_id).
+	# Once full, the oldest transitions are overwritten.
+
+	def __init__(self, capacity=REPLAY_CAPACITY):
+		self.states = numpy.zeros(capacity, dtype=numpy.int32)
+		self.actions = numpy.zeros(capacity, dtype=numpy.int32)
+		self.rewards = numpy.zeros(capacity, dtype=float)
+		self.next_states = numpy.zeros(capacity, dtype=numpy.int32)
+		self.capacity = capacity
+		self.size = 0
+		self.position = 0
+
+	def add(self, states, actions, rewards, next_states):
+		# Appends a batch of transitions given as arrays of equal length
+		count = min(len(states), self.capacity)
+		slots = (self.position + numpy.arange(count)) % self.capacity
+		self.states[slots] = states[-count:]
+		self.actions[slots] = actions[-count:]
+		self.rewards[slots] = rewards[-count:]
+		self.next_states[slots] = next_states[-count:]
+		self.position = (self.position + count) % self.capacity
+		self.size = min(self.size + count, self.capacity)
+
+	def sample(self, count):
+		# Returns 'count' transitions drawn uniformly with replacement as arrays (states, actions, rewards, next_states)
+		slots = numpy.random.randint(0, self.size, count)
+		return self.states[slots], self.actions[slots], self.rewards[slots], self.next_states[slots]
+
+
+class LearningSchedule:
+	# Anytime learning within a fixed wall time budget. Learners call step() after every trial, which is just a counter
+	# increment most of the time - the clock is read only once per roughly DEADLINE_ACCURACY seconds, based on the
+	# number of steps per second measured so far. On every reading the schedule also adapts
+	#  - epsilon, which falls from 1 to EPSILON_MIN during the first half of the budget,
+	#  - alpha, which falls from ALPHA_START to ALPHA_END,
+	#  - episode_length, which is 2 * number_of_states, but never more than the steps that fit into the remaining
+	#    time, and only 2 * (x_dims + y_dims) during the last tenth of the budget, so that only the good paths
+	#    are improved and bad paths are killed early.
+
+	# Optional on_check is called on every reading of the clock (before the budget is exhausted).
+
+	def __init__(self, x_dims, y_dims, max_time=MAX_TIME, margin=TIME_MARGIN, accuracy=DEADLINE_ACCURACY, starting_time=None,
+			on_check=None):
+		self.starting_time = time.time() if starting_time is None else starting_time
+		self.on_check = on_check
+		self.budget = max_time - margin - x_dims * y_dims * POLICY_TIME_PER_STATE
+		self.accuracy = accuracy
+		self.longest_episode = x_dims * y_dims * 2
+		self.shortest_episode = (x_dims + y_dims) * 2
+		self.steps = 0
+		self.steps_per_second = None
+		self.next_check = FIRST_CHECK_STEPS
+		self.finished = self.budget <= 0
+		self.epsilon = 1.0
+		self.alpha = ALPHA_START
+		self.episode_length = self.longest_episode
+
+	def step(self):
+		# Counts a trial. Returns False once the budget is exhausted
+		self.steps += 1
+		if self.steps < self.next_check:
+			return True
+		return self.check()
+
+	def check(self):
+		# Reads the clock and adapts the parameters. Returns False once the budget is exhausted
+		time_elapsed = time.time() - self.starting_time
+		time_remaining = self.budget - time_elapsed
+		if time_remaining <= 0:
+			self.finished = True
+			return False
+		if time_elapsed > 0:
+			self.steps_per_second = self.steps / time_elapsed
+		progress = time_elapsed / self.budget
+		self.epsilon = max(EPSILON_MIN, 1 - 2 * progress)
+		self.alpha = ALPHA_START + (ALPHA_END - ALPHA_START) * progress
+		if progress > 0.9:
+			self.episode_length = self.shortest_episode
+		elif self.steps_per_second is not None:
+			self.episode_length = max(self.shortest_episode, min(self.longest_episode, int(self.steps_per_second * time_remaining)))
+		if self.steps_per_second is None:
+			self.next_check = self.steps + FIRST_CHECK_STEPS
+		else:
+			self.next_check = self.steps + max(1, int(self.steps_per_second * min(self.accuracy, time_remaining)))
+		if self.on_check is not None:
+			self.on_check()
+		return True
+
+	def time_remaining(self):
+		return self.budget - (time.time() - self.starting_time)
+
+
+def extract_policy(Q, x_dims, y_dims):
+	# Builds the policy dict '(x, y) -> best_action' from a flat table of Qvalues
+	# State ids follow the order of itertools.product, see get_state_id
+	return dict(zip(itertools.product(range(x_dims), range(y_dims)), Q.argmax(axis=1).tolist()))
+
+
+def learn_policy(env, vectorized=True, batch_size=BATCH_SIZE, planning_steps=0, algorithm='sarsa', trace_decay=TRACE_DECAY,
+		max_time=MAX_TIME, workers=1, merge='visits'):
+	# Runs SARSA algorithm on given square grid environment for twenty seconds (max_time).
+	# Returns a policy as dictionary mapping state coordinates to actions '(x, y) -> hopefully_optimal_action'
+	# Needs to keep track of elapsed time in order not to be killed by the automati evaluation engine (see LearningSchedule)
+	# With planning_steps > 0 (vectorized only), every real step is followed by as many Dyna-Q updates replayed
+	# from the remembered transitions.
+	# Algorithms 'sarsa_lambda' and 'q_lambda' (Watkins) learn with eligibility traces instead, see learn_policy_traces.
+	# With workers > 1 (vectorized SARSA only), the learning runs in as many processes, see learn_policy_parallel.
+	if algorithm not in ALGORITHMS:
+		raise ValueError('Unknown algorithm {}, expected one of {}'.format(algorithm, ', '.join(ALGORITHMS)))
+	if merge not in MERGE_METHODS:
+		raise ValueError('Unknown merge method {}, expected one of {}'.format(merge, ', '.join(MERGE_METHODS)))
+	if workers > 1 and algorithm == 'sarsa' and vectorized:
+		return learn_policy_parallel(env, workers, batch_size, planning_steps, max_time, merge)
+	if algorithm != 'sarsa':
+		return learn_policy_traces(env, trace_decay, watkins=algorithm == 'q_lambda', max_time=max_time)
+	if vectorized:
+		return learn_policy_vectorized(env, batch_size, planning_steps, max_time)
 
 	# Maze size
 	x_dims = env.observation_space.spaces[0].n
 	y_dims = env.observation_space.spaces[1].n
 	action_count = env.action_space.n
+	schedule = LearningSchedule(x_dims, y_dims, max_time)
 
 	# Initialize policy to defaut "everytime north". This policy will be updated every time 
 	policy = {(x, y) : 0 for x, y in itertools.product(range(x_dims), range(y_dims))}
@@ -30,26 +187,12 @@ def learn_policy(env):
 	# and eventually converge to optimal policy
 	Q = numpy.zeros([x_dims, y_dims, action_count], dtype=float)
 
-	alpha = 0.1 # Exponential decay coefficient. Values are updated using formula old := (1 - alpha) * old + alpha * new
+	# Exponential decay coefficient alpha is given by the schedule. Values are updated using formula old := (1 - alpha) * old + alpha * new
 	discount = 0.9 # Factor gamma that decreases the importance of distant future rewards.
 
 	# Each episode ends when goal is reached or the procedure times out. To prevent infinite loops, allow at most
-	# 2 * number_of_states trials in a single episode.
-	EPISODE_LENGTH = x_dims * y_dims * 2
-	MAX_TIME = 20
-
-	while True:
-		time_elapsed = time.time() - starting_time
-		time_remaining = MAX_TIME - time_elapsed
-		if time_remaining < 0.5: #safety margin so that the algorithm does not get killed
-			return policy #exit it we have run out of time
-
-		# If the time is running out, it is wise to shorten episodes, so that only the good paths are 
-		# improved and bad paths are killed early.
-		if time_remaining < MAX_TIME / 10:
-			EPISODE_LENGTH = (x_dims + y_dims) * 2
-
-
+	# schedule.episode_length trials in a single episode.
+	while not schedule.finished:
 		#start an episode
 		this_state = tuple(env.reset()[0:2])
 
@@ -58,11 +201,12 @@ def learn_policy(env):
 		# epsilon an action will be generated at random. With probability 1-epsilon an action will be deterministic
 		# governed by the current policy. The coefficient epsilon is a nonincreasing function of time, so that as the time
 		# progresses, the agent switches from a lot of exploration (epsilon ~ 1) to a lot of exploitation (epsilon ~ 0, but it 
-		# is clamped to be at least 0.1).
-		epsilon = max(0.1, 1 - time_elapsed/10)
+		# is clamped to be at least EPSILON_MIN).
+		epsilon = schedule.epsilon
+		alpha = schedule.alpha
 
 		t = 0
-		while t < EPISODE_LENGTH:
+		while t < schedule.episode_length:
 
 			# Choose At and execute it. Observe new state and transition reward. This constitutes a single trial (a step within an episode)
 			this_action = env.action_space.sample() if random.random() < epsilon else policy[this_state]
@@ -83,8 +227,245 @@ def learn_policy(env):
 			policy[this_state] = best_action
 
 			# Finally check whether the episode should continue and if so, advance the agent to the next state
-			if done:
+			if done or not schedule.step():
 				break
 			this_state = next_state
 			t += 1		
 
+	return policy
+
+
+def update_Q_values(Q, greedy, batch, discount, alpha, visits=None):
+	# Applies a batch of SARSA trials (rows of state id, action, reward, next state id, next action) at once.
+	# Every trial is evaluated with Qvalues from before the batch. Errors of repeated pairs (St, At) are averaged,
+	# so that each pair moves by at most alpha times its error however often it occurs in the batch (e.g. many agents
+	# in the start state, or a transition replayed several times by plan).
+	# Afterwards the greedy actions of touched states are refreshed. Trials are also counted in visits, if given.
+	states, actions, next_states, next_actions = (batch[:, i].astype(int) for i in (0, 1, 3, 4))
+	trial_costs = batch[:, 2] + discount * Q[next_states, next_actions]
+	errors = trial_costs - Q[states, actions]
+	action_count = Q.shape[1]
+	pairs, pair_index, pair_counts = numpy.unique(states * action_count + actions, return_inverse=True, return_counts=True)
+	mean_errors = numpy.bincount(pair_index, weights=errors) / pair_counts
+	Q[pairs // action_count, pairs % action_count] += alpha * mean_errors
+	if visits is not None:
+		visits[pairs // action_count, pairs % action_count] += pair_counts
+	touched = numpy.unique(states)
+	greedy[touched] = Q[touched].argmax(axis=1)
+
+
+def plan(Q, greedy, replay_buffer, count, discount, alpha):
+	# Dyna-Q planning - replays 'count' remembered transitions. The buffer serves as a sample model of the environment,
+	# so stochastic transitions are replayed with their observed frequencies. Since the next action is the greedy one,
+	# each replayed trial is a Q-learning backup.
+	states, actions, rewards, next_states = replay_buffer.sample(count)
+	batch = numpy.column_stack((states, actions, rewards, next_states, greedy[next_states]))
+	update_Q_values(Q, greedy, batch, discount, alpha)
+
+
+def learn_policy_vectorized(env, batch_size=BATCH_SIZE, planning_steps=0, max_time=MAX_TIME):
+	# The same SARSA as learn_policy, but batch_size agents explore copies of env at once (see kuimaze.VectorHardMaze),
+	# Qvalues are kept in a flat table indexed by state ids (see get_state_id) and the trials of one step of all agents
+	# are applied as a single batch. Instead of a policy dict kept in sync with every update, only the greedy action
+	# of states touched by a batch is recomputed; the policy dict is built once at the end.
+	# Each applied batch is followed by planning_steps Dyna-Q updates per real trial in the batch.
+
+	x_dims = env.observation_space.spaces[0].n
+	y_dims = env.observation_space.spaces[1].n
+	action_count = env.action_space.n
+	schedule = LearningSchedule(x_dims, y_dims, max_time)
+
+	Q = numpy.zeros([x_dims * y_dims, action_count], dtype=float)
+	greedy = numpy.zeros(x_dims * y_dims, dtype=int)
+	train_vectorized(kuimaze.VectorHardMaze(batch_size, *env.get_settings()), Q, greedy, schedule, planning_steps)
+	return extract_policy(Q, x_dims, y_dims)
+
+
+def train_vectorized(envs, Q, greedy, schedule, planning_steps=0, visits=None):
+	# Learning loop of learn_policy_vectorized on a kuimaze.VectorHardMaze. Updates the given flat table of Qvalues
+	# and greedy actions in place until the schedule is finished. Counts the applied trials in visits, if given.
+	# Every agent runs its own episodes - it is sent back to the start once it reaches the goal or its episode
+	# exceeds schedule.episode_length. The schedule counts steps of the whole batch.
+
+	y_dims = envs.observation_space.spaces[1].n
+	action_count = envs.action_space.n
+	replay_buffer = ReplayBuffer() if planning_steps > 0 else None
+
+	discount = 0.9
+
+	envs.reset()
+	this_states = get_state_id(envs.positions.T, y_dims)
+	episode_steps = numpy.zeros(envs.num_envs, dtype=int)
+
+	while not schedule.finished:
+		explore = numpy.random.random(envs.num_envs) < schedule.epsilon
+		these_actions = numpy.where(explore, numpy.random.randint(action_count, size=envs.num_envs), greedy[this_states])
+		observations, rewards, dones, _ = envs.step(these_actions)
+		next_states = get_state_id(observations[:, :2].T.astype(int), y_dims)
+
+		batch = numpy.column_stack((this_states, these_actions, rewards, next_states, greedy[next_states]))
+		update_Q_values(Q, greedy, batch, discount, schedule.alpha, visits)
+		if replay_buffer is not None:
+			replay_buffer.add(this_states, these_actions, rewards, next_states)
+			plan(Q, greedy, replay_buffer, planning_steps * envs.num_envs, discount, schedule.alpha)
+
+		if not schedule.step():
+			break
+		episode_steps += 1
+		ended = dones | (episode_steps >= schedule.episode_length)
+		if ended.any():
+			envs.reset(ended)
+			episode_steps[ended] = 0
+		this_states = get_state_id(envs.positions.T, y_dims)
+
+
+def merge_Q_tables(Q_tables, visit_tables, method='visits'):
+	# Merges tables of Qvalues of parallel workers, stacked along the first axis. Method 'average' takes the plain mean,
+	# 'visits' weights each Qvalue by the number of trials the worker applied to it (falling back to the mean where
+	# no worker has tried the pair yet).
+	if method == 'average':
+		return Q_tables.mean(axis=0)
+	total_visits = visit_tables.sum(axis=0)
+	weighted = (Q_tables * visit_tables).sum(axis=0)
+	return numpy.where(total_visits > 0, weighted / numpy.maximum(total_visits, 1), Q_tables.mean(axis=0))
+
+
+def run_worker(worker, workers, env_args, memory_name, barrier, starting_time, max_time, batch_size, planning_steps, merge, seed):
+	# Body of a process of learn_policy_parallel. Learns on its own VectorHardMaze, its table of Qvalues and visit counts live
+	# in the shared memory. Every MERGE_INTERVAL seconds all workers meet at the barrier, compute the merged table
+	# and, once everybody has read the tables, replace their own table with it.
+	random.seed(seed)
+	numpy.random.seed(seed)
+	envs = kuimaze.VectorHardMaze(batch_size, *env_args)
+	envs.seed(seed)
+	x_dims = envs.observation_space.spaces[0].n
+	y_dims = envs.observation_space.spaces[1].n
+	memory = shared_memory.SharedMemory(name=memory_name)
+	tables = numpy.ndarray([2, workers, x_dims * y_dims, envs.action_space.n], dtype=float, buffer=memory.buf)
+	Q = tables[0, worker]
+	visits = tables[1, worker]
+	greedy = numpy.zeros(x_dims * y_dims, dtype=int)
+	next_merge = [starting_time + MERGE_INTERVAL]
+
+	def synchronize():
+		if time.time() < next_merge[0] or barrier.broken:
+			return
+		next_merge[0] += MERGE_INTERVAL
+		# All workers share the clock and the budget, so they agree on skipping the merge close to the deadline
+		if schedule.time_remaining() < MERGE_INTERVAL / 2:
+			return
+		try:
+			barrier.wait(MERGE_TIMEOUT)
+			merged = merge_Q_tables(tables[0], tables[1], merge)
+			barrier.wait(MERGE_TIMEOUT)
+		except threading.BrokenBarrierError:
+			return
+		Q[:] = merged
+		greedy[:] = Q.argmax(axis=1)
+
+	schedule = LearningSchedule(x_dims, y_dims, max_time, starting_time=starting_time, on_check=synchronize)
+	train_vectorized(envs, Q, greedy, schedule, planning_steps, visits)
+	del Q, visits, tables
+	memory.close()
+
+
+def learn_policy_parallel(env, workers, batch_size=BATCH_SIZE, planning_steps=0, max_time=MAX_TIME, merge='visits'):
+	# Vectorized SARSA in several processes. Each worker learns on its own VectorHardMaze with the same map, gradient,
+	# probabilities and rewards as env, but a different seed. The workers periodically merge their tables of Qvalues
+	# through shared memory (see run_worker), the final policy is extracted from the tables merged after the deadline.
+
+	starting_time = time.time()
+	x_dims = env.observation_space.spaces[0].n
+	y_dims = env.observation_space.spaces[1].n
+	action_count = env.action_space.n
+
+	env_args = env.get_settings()
+
+	shape = [2, workers, x_dims * y_dims, action_count]
+	memory = shared_memory.SharedMemory(create=True, size=int(numpy.prod(shape)) * numpy.dtype(float).itemsize)
+	try:
+		tables = numpy.ndarray(shape, dtype=float, buffer=memory.buf)
+		tables[:] = 0
+		barrier = multiprocessing.Barrier(workers)
+		seed = random.randrange(2**31)
+		processes = [multiprocessing.Process(target=run_worker, daemon=True, args=(worker, workers, env_args, memory.name, barrier,
+				starting_time, max_time, batch_size, planning_steps, merge, seed + worker)) for worker in range(workers)]
+		for process in processes:
+			process.start()
+		for process in processes:
+			# The workers stop learning TIME_MARGIN before the deadline, the rest of it is left for merging the tables
+			process.join(max(0, starting_time + max_time - TIME_MARGIN - time.time()))
+			if process.is_alive():
+				process.terminate()
+		policy = extract_policy(merge_Q_tables(tables[0], tables[1], merge), x_dims, y_dims)
+		del tables
+	finally:
+		memory.close()
+		memory.unlink()
+	return policy
+
+
+def learn_policy_traces(env, trace_decay=TRACE_DECAY, watkins=False, max_time=MAX_TIME):
+	# SARSA(lambda), or Watkins Q(lambda) if watkins is set, with replacing eligibility traces. The error of every trial
+	# is propagated to all recently visited pairs (St, At) at once, so the reward of the goal travels back along
+	# a long corridor in a few episodes instead of one cell per episode.
+	# Traces are sparse - only the active pairs are kept, as flat indices into the table of Qvalues and their traces.
+	# Each step decays just them and drops those below TRACE_CUTOFF.
+
+	x_dims = env.observation_space.spaces[0].n
+	y_dims = env.observation_space.spaces[1].n
+	action_count = env.action_space.n
+	schedule = LearningSchedule(x_dims, y_dims, max_time)
+
+	Q = numpy.zeros([x_dims * y_dims, action_count], dtype=float)
+	Q_flat = Q.reshape(-1)
+
+	discount = 0.9
+
+	while not schedule.finished:
+		epsilon = schedule.epsilon
+		alpha = schedule.alpha
+		trace_ids = numpy.zeros(0, dtype=int)
+		traces = numpy.zeros(0, dtype=float)
+
+		observation = env.reset()
+		this_state = get_state_id(observation, y_dims)
+		this_action = random.randrange(action_count) if random.random() < epsilon else int(Q[this_state].argmax())
+		for t in range(schedule.episode_length):
+			observation, reward, done, _ = env.step(this_action)
+			next_state = get_state_id(observation, y_dims)
+			best_action = int(Q[next_state].argmax())
+			next_action = random.randrange(action_count) if random.random() < epsilon else best_action
+
+			# SARSA evaluates the action that will be taken, Q-learning the best one
+			target_action = best_action if watkins else next_action
+			error = reward + discount * Q[next_state, target_action] - Q[this_state, this_action]
+
+			# Replacing trace of the current pair
+			pair = this_state * action_count + this_action
+			hit = numpy.flatnonzero(trace_ids == pair)
+			if hit.size:
+				traces[hit] = 1.0
+			else:
+				trace_ids = numpy.append(trace_ids, pair)
+				traces = numpy.append(traces, 1.0)
+
+			Q_flat[trace_ids] += alpha * error * traces
+
+			if done or not schedule.step():
+				break
+
+			# Watkins Q(lambda) learns about the greedy policy, so an exploratory action breaks the chain of credit
+			if watkins and Q[next_state, next_action] < Q[next_state, best_action]:
+				trace_ids = trace_ids[:0]
+				traces = traces[:0]
+			else:
+				traces *= discount * trace_decay
+				active = traces >= TRACE_CUTOFF
+				trace_ids = trace_ids[active]
+				traces = traces[active]
+
+			this_state = next_state
+			this_action = next_action
+
+	return extract_policy(Q, x_dims, y_dims)
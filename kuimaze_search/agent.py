@@ -5,6 +5,8 @@ import kuimaze
 import os
 import random
 import collections
+import heapq
+import itertools
 
 
 Coord = collections.namedtuple('Coord', ['col', 'row'])
@@ -38,8 +40,14 @@ class Agent(kuimaze.BaseAgent):
         # there is no need to return to it (by the nature and optimality of A* algorithm)
         #This optimality is guaranteed by choice of heuristic
         explored = set()
-        # List of tiles that shall be explored further
-        frontier = { start_coord: Node(start_coord, None, 0, 0) }
+        # Tiles that shall be explored further, kept as a binary heap of (estimated total cost, tie breaker, node).
+        # Instead of a decrease-key operation, an improved node is pushed again and the outdated entry is skipped
+        # once it is popped (lazy deletion). The tie breaker keeps the heap from ever comparing two Nodes.
+        frontier = []
+        tie_breaker = itertools.count()
+        # Lowest known cost to come for every tile currently present in the frontier
+        best_cost2come = { start_coord: 0 }
+        heapq.heappush(frontier, (0, next(tie_breaker), Node(start_coord, None, 0, 0)))
 
         #Returns the difference in columns or rows of given tile and the goal. Use to compute Manhattan metric
         delta_x = lambda coord: abs(coord.col - goal_coord.col)
@@ -63,9 +71,10 @@ class Agent(kuimaze.BaseAgent):
         goal_node = None
         while len(frontier) > 0:
             # Find the best candidate to expore
-
-            _, cheapest = min(frontier.items(), key = lambda node: node[1].cost2come + heuristic(node[1].coord))
-            del frontier[cheapest.coord] # remove the selected node from the frontier
+            _, _, cheapest = heapq.heappop(frontier)
+            if cheapest.coord in explored:
+                continue # outdated entry, this tile has already been closed with a lower cost to come
+            del best_cost2come[cheapest.coord] # remove the selected node from the frontier
             explored.add(cheapest.coord) # and mark this coord as explored never to return again
 
             if cheapest.coord == goal_coord:
@@ -83,8 +92,10 @@ class Agent(kuimaze.BaseAgent):
                 new_cost2come = cheapest.cost2come + edge_cost
 
                 #add this new tile to the frontier or update it, if already present and the previous cost to come was strictly greater
-                if coord not in frontier or frontier[coord].cost2come > new_cost2come:
-                    frontier[coord] = Node(coord, cheapest, new_cost2come, new_cost2come + heuristic(coord))
+                if coord not in best_cost2come or best_cost2come[coord] > new_cost2come:
+                    best_cost2come[coord] = new_cost2come
+                    node = Node(coord, cheapest, new_cost2come, new_cost2come + heuristic(coord))
+                    heapq.heappush(frontier, (node.cost, next(tie_breaker), node))
 
             #time.sleep(0.1)                         # sleep for demonstartion     DO NOT FORGET TO COMMENT THIS LINE BEFORE FINAL SUBMISSION! 
             #self.environment.render()               # show enviroment's GUI       DO NOT FORGET TO COMMENT THIS LINE BEFORE FINAL SUBMISSION!      
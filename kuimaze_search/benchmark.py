@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''
+Measures the throughput of the A* agent from agent.py - the number of expanded nodes per second.
+Runs on all bundled maps from maps/normal and on randomly generated square maps of given sizes.
+
+usage: python benchmark.py [size1 size2 ...]
+'''
+
+import glob
+import os
+import sys
+import time
+
+import numpy
+
+import kuimaze
+from agent import Agent
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps', 'normal')
+GENERATED_SIZES = [100, 250, 500]
+WALL_DENSITY = 0.25
+SEED = 42
+
+
+class CountingMaze(kuimaze.InfEasyMaze):
+    '''
+    Informed easy maze that counts the number of calls of expand
+    '''
+    def __init__(self, map_image=None, grad=(0, 0)):
+        self.expansions = 0
+        super(CountingMaze, self).__init__(map_image, grad)
+
+    def expand(self, position):
+        self.expansions += 1
+        return super(CountingMaze, self).expand(position)
+
+
+def generate_map(size, density=WALL_DENSITY, seed=SEED):
+    '''
+    Generates a square map with randomly scattered walls, start in the top left and goal in the bottom right corner.
+    @return: RGB image as numpy array of shape (size, size, 3)
+    '''
+    rng = numpy.random.default_rng(seed)
+    image = numpy.full((size, size, 3), 255, dtype=int)
+    image[rng.random((size, size)) < density] = [0, 0, 0]
+    image[0, 0] = [0, 0, 255]
+    image[-1, -1] = [255, 0, 0]
+    return image
+
+
+def run(name, map_image):
+    env = CountingMaze(map_image=map_image)
+    if len(env.reset()) != 2:
+        print('{:<24} skipped - the agent supports only a single goal'.format(name))
+        return
+    agent = Agent(env)
+    start = time.perf_counter()
+    path = agent.find_path()
+    elapsed = time.perf_counter() - start
+    path_length = 0 if path is None else len(path)
+    print('{:<24} {:>10} {:>10.3f} {:>14.0f} {:>8}'.format(
+        name, env.expansions, elapsed, env.expansions / elapsed, path_length))
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or GENERATED_SIZES
+    print('{:<24} {:>10} {:>10} {:>14} {:>8}'.format('map', 'expanded', 'time [s]', 'expansions/s', 'path'))
+    for map_file in sorted(glob.glob(os.path.join(MAPS_DIR, '*.bmp'))):
+        run(os.path.basename(map_file), map_file)
+    for size in sizes:
+        run('random {0}x{0}'.format(size), generate_map(size))
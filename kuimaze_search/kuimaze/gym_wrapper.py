@@ -26,9 +26,11 @@ class MazeEnv(gym.Env):
     metadata = {'render.modes': ['human']}
     _path = []
     _visited = []
+    _visited_grid = None
     MAP = '../maps/easy/easy3.bmp'
 
-    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None):
+    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None,
+                 hard_places_are_goals=True, verbose=False):
         '''
         Class wrapping Maze into gym enviroment.
         @param informed: boolean
@@ -36,6 +38,8 @@ class MazeEnv(gym.Env):
         @param deter: boolean - T = deterministic maze, F = probabilistic maze
         @param map_image_dir: string - path to image of map
         @param grad: tuple - vector tuning the tilt of maze`
+        @param hard_places_are_goals: boolean - T = hard places end the episode like goals, F = they are just expensive
+        @param verbose: boolean - T = print diagnostic messages of the maze to stdout
         '''
         if map_image_dir is None:
             '''
@@ -52,7 +56,8 @@ class MazeEnv(gym.Env):
             self._grad = (0, 0)
         else:
             self._grad = grad
-        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards)
+        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards,
+                                     hard_places_are_goals=hard_places_are_goals, verbose=verbose)
         self._player = EnvAgent(self._problem)
         self._curr_state = self._problem.get_start_state()
         self._informed = informed
@@ -76,8 +81,7 @@ class MazeEnv(gym.Env):
             action = self._problem.non_det_result(action)
         self._curr_state = self._problem.result(self._curr_state, action)
         self._path.append(self._curr_state)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._mark_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         # reward = self._problem.get_state_reward(self._curr_state)
         return self._get_observation(), reward, done, None
@@ -94,14 +98,35 @@ class MazeEnv(gym.Env):
         self._gui_disabled = True
         self._path = []
         self._visited = []
+        self._visited_grid = np.zeros((self._xsize, self._ysize), dtype=bool)
         self._problem.clear_player_data()
         self._problem.set_player(self._player)
         if self._gym_compatible:
             self._path.append(self._problem.get_start_state())
-        self._visited.append(self._problem.get_start_state())
+        self._mark_visited(self._problem.get_start_state())
         self._curr_state = self._problem.get_start_state()
         return self._get_observation()
 
+    def _mark_visited(self, new_state):
+        '''
+        Records the state as visited. Visited states are kept in a boolean grid for constant time lookup
+        and in a list ordered by the time of the first visit, which is used for rendering.
+        @param new_state: namedtuple state
+        @return: None
+        '''
+        if not self._visited_grid[new_state.x, new_state.y]:
+            self._visited_grid[new_state.x, new_state.y] = True
+            self._visited.append(new_state)
+
+    def _is_visited(self, new_state):
+        '''
+        returns true if the state has already been visited
+        @param new_state: namedtuple state
+        @return: boolean
+        '''
+        return 0 <= new_state.x < self._xsize and 0 <= new_state.y < self._ysize and \
+            bool(self._visited_grid[new_state.x, new_state.y])
+
     def render(self, mode='human', close=False, visited=None, explored=None):
         assert self._set, "reset() must be called first!"
         self._gui_disabled = False
@@ -254,16 +279,26 @@ class EasyMazeEnv(MazeEnv):
     Unlike the HardMaze, EasyMaze has additional method set_path - which can set different path than agent movement.
     '''
 
-    def __init__(self, informed, map_image_dir=None, grad=(0, 0)):
-        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad)
+    def __init__(self, informed, map_image_dir=None, grad=(0, 0), adjacency_index=True, hard_places_are_goals=True,
+                 verbose=False):
+        '''
+        @param adjacency_index: boolean - T = precompute neighbours and movement costs of all cells, so that expand is
+        just a lookup, F = compute them on every call of expand
+        '''
+        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad,
+                                          hard_places_are_goals=hard_places_are_goals, verbose=verbose)
         self._gui_on = False
+        self._adjacency_ptr = None
+        self._adjacency_neighbours = None
+        self._adjacency_costs = None
+        if adjacency_index:
+            self._build_adjacency_index()
 
     def step(self, action):
         last_state = self._curr_state
         assert (type(action) == list or type(action) == tuple) and len(action) == 2
         self._curr_state = self._easy_result(action)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._mark_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         return self._get_observation(), reward, done, None
 
@@ -298,13 +333,9 @@ class EasyMazeEnv(MazeEnv):
         @param new_state:
         @return: boolean
         '''
-        tmp = []
-        tmp.extend(self._visited)
-        tmp.extend([self._problem.result(self._curr_state, 0), self._problem.result(self._curr_state, 1),
-                    self._problem.result(self._curr_state, 2), self._problem.result(self._curr_state, 3),
-                    self._problem.result(self._curr_state, 4), self._problem.result(self._curr_state, 5),
-                    self._problem.result(self._curr_state, 6), self._problem.result(self._curr_state, 6)])
-        return new_state in tmp
+        if self._is_visited(new_state):
+            return True
+        return any(new_state == self._problem.result(self._curr_state, action) for action in range(8))
 
     def _easy_result(self, state_list):
         '''
@@ -338,6 +369,37 @@ class EasyMazeEnv(MazeEnv):
             reward = pow(pow(vector[0],2) + pow(vector[1],2),1/2) + z_axis + addition_cost
         return reward
 
+    def _build_adjacency_index(self):
+        '''
+        Precomputes neighbours of every cell together with the costs of movement to them. The maze is static, so the
+        result of expand can be stored in compressed sparse row format - neighbours of the cell with index
+        x * ysize + y are stored in the slice [ptr[index], ptr[index + 1]) of the lists of neighbours and costs.
+        Costs are computed the same way as in L{_get_cost}, including the gradient and the hard places penalty.
+        @return: None
+        '''
+        passable = self._problem.get_passable_grid()
+        deltas = np.array(self._problem.get_action_deltas())
+        xs, ys = np.meshgrid(np.arange(self._xsize), np.arange(self._ysize), indexing='ij')
+        # coordinates of all neighbours, shape (xsize, ysize, number of actions)
+        nxs = xs[:, :, np.newaxis] + deltas[:, 0]
+        nys = ys[:, :, np.newaxis] + deltas[:, 1]
+        valid = (nxs >= 0) & (nxs < self._xsize) & (nys >= 0) & (nys < self._ysize)
+        valid[valid] = passable[nxs[valid], nys[valid]]
+
+        hard = np.zeros(passable.shape, dtype=bool)
+        for place in self._problem.hard_places:
+            hard[place.x, place.y] = True
+        # _get_cost is called with the expanded position as the new state, hence the vector points back to it
+        vectors = -deltas
+        z_axis = vectors[:, 0] * self._grad[0] + vectors[:, 1] * self._grad[1]
+        costs = np.sqrt(vectors[:, 0] ** 2 + vectors[:, 1] ** 2) + z_axis
+        costs = costs + np.where(hard, 5, 0)[:, :, np.newaxis]
+
+        counts = valid.reshape(-1, len(deltas)).sum(axis=1)
+        self._adjacency_ptr = np.concatenate(([0], np.cumsum(counts))).tolist()
+        self._adjacency_neighbours = list(zip(nxs[valid].tolist(), nys[valid].tolist()))
+        self._adjacency_costs = costs[valid].tolist()
+
     def expand(self,position):
         '''
         returns tuple of positions with associated costs that can be visited from "position"
@@ -345,6 +407,23 @@ class EasyMazeEnv(MazeEnv):
 
         @return: tuple of coordinates [x, y] with "cost" for movement to these positions: [[[x1, y1], cost1], [[x2, y2], cost2], ... ]
         '''
+        if self._adjacency_ptr is None or not (0 <= position[0] < self._xsize and 0 <= position[1] < self._ysize):
+            return self._expand_by_result(position)
+        index = position[0] * self._ysize + position[1]
+        begin = self._adjacency_ptr[index]
+        end = self._adjacency_ptr[index + 1]
+        neighbours = self._adjacency_neighbours[begin:end]
+        for neighbour in neighbours:
+            new_state = state(*neighbour)
+            self._mark_visited(new_state)
+        return [[neighbour, cost] for neighbour, cost in zip(neighbours, self._adjacency_costs[begin:end])]
+
+    def _expand_by_result(self, position):
+        '''
+        expand without the precomputed adjacency index, computes all neighbours by L{Maze.result}
+        @param position: position in the maze defined by coordinates (x,y)
+        @return: the same as L{expand}
+        '''
         expanded_nodes = []
         maze_pose = state(position[0], position[1])
         tmp = [self._problem.result(maze_pose, 0), self._problem.result(maze_pose, 1),
@@ -354,8 +433,7 @@ class EasyMazeEnv(MazeEnv):
         for new_state in tmp:
             if new_state.x == maze_pose.x and new_state.y == maze_pose.y:
                 continue
-            if new_state not in self._visited:
-                self._visited.append(new_state)
+            self._mark_visited(new_state)
             reward = self._get_cost(maze_pose, new_state)
             expanded_nodes.append([(new_state.x, new_state.y), reward])
         return expanded_nodes
@@ -390,8 +468,9 @@ class InfEasyMaze(EasyMazeEnv):
     informed easy maze, suitable for A* implementation
     step([x, y])
     '''
-    def __init__(self, map_image=None, grad=(0, 0)):
-        super(InfEasyMaze, self).__init__(True, map_image, grad)
+    def __init__(self, map_image=None, grad=(0, 0), adjacency_index=True, verbose=False):
+        super(InfEasyMaze, self).__init__(True, map_image, grad, adjacency_index, hard_places_are_goals=False,
+                                          verbose=verbose)
 
 
 class EasyMaze(EasyMazeEnv):
@@ -399,20 +478,20 @@ class EasyMaze(EasyMazeEnv):
     uninformed easy maze, suitable for BFS, DFS ...
     step([x, y])
     '''
-    def __init__(self, map_image=None, grad=(0, 0)):
-        super(EasyMaze, self).__init__(False, map_image, grad)
+    def __init__(self, map_image=None, grad=(0, 0), adjacency_index=True, verbose=False):
+        super(EasyMaze, self).__init__(False, map_image, grad, adjacency_index, verbose=verbose)
 
 
 class MDPMaze(MazeEnv):
     '''
     maze for solving MDP problems
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
         if probs is not None:
-            super().__init__(False, True, False, map_image, grad, node_rewards=node_rewards)
+            super().__init__(False, True, False, map_image, grad, node_rewards=node_rewards, verbose=verbose)
             self._problem.set_probs_table(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super().__init__(False, True, True, map_image, grad)
+            super().__init__(False, True, True, map_image, grad, verbose=verbose)
 
     def _get_reward(self, curr, last):
         '''
@@ -456,12 +535,12 @@ class HardMaze(MazeEnv):
     Uninformed hard maze, suitable for reinforcement learning
     step(param) where param is integer; 0 <= param <= 3
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, node_rewards=None, verbose=False):
         if probs is not None:
-            super(HardMaze, self).__init__(False, True, False, map_image, grad, node_rewards=node_rewards)
+            super(HardMaze, self).__init__(False, True, False, map_image, grad, node_rewards=node_rewards, verbose=verbose)
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super(HardMaze, self).__init__(False, True, True, map_image, grad)
+            super(HardMaze, self).__init__(False, True, True, map_image, grad, verbose=verbose)
 
     def _get_reward(self, curr, last):
         '''
@@ -489,9 +568,9 @@ class InfHardMaze(MazeEnv):
     Informed hard maze, suitable for reinforcement learning
     step(param) where param is integer; 0 <= param <= 3
     '''
-    def __init__(self, map_image=None, grad=(0, 0), probs=None):
+    def __init__(self, map_image=None, grad=(0, 0), probs=None, verbose=False):
         if probs is not None:
-            super(InfHardMaze, self).__init__(True, True, False, map_image, grad)
+            super(InfHardMaze, self).__init__(True, True, False, map_image, grad, verbose=verbose)
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
-            super(InfHardMaze, self).__init__(True, True, True, map_image, grad)
+            super(InfHardMaze, self).__init__(True, True, True, map_image, grad, verbose=verbose)
@@ -1,6 +1,3 @@
-import copy
-
-
 class GameBoard(object):
 
     def __init__(self, board_size=8,
@@ -10,9 +7,11 @@ class GameBoard(object):
         self.p2_color = player2_color
         self.empty_color = empty_color
         self.board = self.init_board()
+        self.init_move_state()
 
     def clear(self):
         self.board = self.init_board()
+        self.init_move_state()
 
     def init_board(self):
         '''
@@ -30,6 +29,22 @@ class GameBoard(object):
         board[half_board-1][half_board] = self.p2_color
         return board
 
+    def init_move_state(self):
+        '''
+        Finds valid moves and counts stones of both players from scratch.
+        play_move then keeps them up to date incrementally.
+        :return: {None}
+        '''
+        self.valid_moves = {self.p1_color: set(), self.p2_color: set()}
+        self.stones = {self.p1_color: 0, self.p2_color: 0}
+        for x in range(self.board_size):
+            for y in range(self.board_size):
+                if self.board[x][y] == self.empty_color:
+                    for color in self.get_colors_with_valid_move((x, y)):
+                        self.valid_moves[color].add((x, y))
+                else:
+                    self.stones[self.board[x][y]] += 1
+
     def play_move(self, move, players_color):
         '''
         :param move: {list} of {int} for position where the move is made
@@ -39,9 +54,76 @@ class GameBoard(object):
         self.board[move[0]][move[1]] = players_color
         dx = [-1, -1, -1, 0, 1, 1, 1, 0]
         dy = [-1, 0, 1, 1, 1, 0, -1, -1]
+        changed = [(move[0], move[1])]
         for i in range(len(dx)):
             if self.confirm_direction(move, dx[i], dy[i], players_color):
-                self.change_stones_in_direction(move, dx[i], dy[i], players_color)
+                changed += self.change_stones_in_direction(move, dx[i], dy[i], players_color)
+
+        opponents_color = self.p2_color if players_color == self.p1_color else self.p1_color
+        self.stones[players_color] += len(changed)
+        self.stones[opponents_color] -= len(changed) - 1
+        self.update_valid_moves(changed)
+
+    def update_valid_moves(self, changed):
+        '''
+        Updates the sets of valid moves after the stones on the given positions were placed or flipped.
+        Validity of a move can change only if a line of stones leads from it to a changed stone,
+        so only the first empty positions behind the changed stones in each direction are checked again.
+        :param changed: {list} of positions of the placed stone and of the flipped stones
+        :return: {None}
+        '''
+        dx = [-1, -1, -1, 0, 1, 1, 1, 0]
+        dy = [-1, 0, 1, 1, 1, 0, -1, -1]
+        board = self.board
+        size = self.board_size
+        affected = set()
+        for x, y in changed:
+            for i in range(len(dx)):
+                posx = x + dx[i]
+                posy = y + dy[i]
+                while (0 <= posx < size and 0 <= posy < size and
+                       board[posx][posy] != self.empty_color):
+                    posx += dx[i]
+                    posy += dy[i]
+                if 0 <= posx < size and 0 <= posy < size:
+                    affected.add((posx, posy))
+
+        for color, valid_moves in self.valid_moves.items():
+            valid_moves.discard(changed[0])
+        for position in affected:
+            colors = self.get_colors_with_valid_move(position)
+            for color, valid_moves in self.valid_moves.items():
+                if color in colors:
+                    valid_moves.add(position)
+                else:
+                    valid_moves.discard(position)
+
+    def get_colors_with_valid_move(self, position):
+        '''
+        Finds both players' valid moves at an empty position in a single pass - a line of stones
+        of one color followed by a stone of the other color makes the move valid for the other color.
+        :param position: {tuple} of {int} empty position
+        :return: {set} of colors of players who can play at the position
+        '''
+        dx = [-1, -1, -1, 0, 1, 1, 1, 0]
+        dy = [-1, 0, 1, 1, 1, 0, -1, -1]
+        board = self.board
+        size = self.board_size
+        colors = set()
+        for i in range(len(dx)):
+            posx = position[0] + dx[i]
+            posy = position[1] + dy[i]
+            if not (0 <= posx < size and 0 <= posy < size):
+                continue
+            line_color = board[posx][posy]
+            if line_color == self.empty_color:
+                continue
+            while 0 <= posx < size and 0 <= posy < size and board[posx][posy] == line_color:
+                posx += dx[i]
+                posy += dy[i]
+            if 0 <= posx < size and 0 <= posy < size and board[posx][posy] != self.empty_color:
+                colors.add(board[posx][posy])
+        return colors
 
     def is_correct_move(self, move, players_color):
         '''
@@ -49,14 +131,7 @@ class GameBoard(object):
         :param players_color: {int}
         :return: {bool}
         '''
-        if self.board[move[0]][move[1]] == self.empty_color:
-            dx = [-1, -1, -1, 0, 1, 1, 1, 0]
-            dy = [-1, 0, 1, 1, 1, 0, -1, -1]
-            for i in range(len(dx)):
-                if self.confirm_direction(move, dx[i], dy[i], players_color):
-                    return True
-
-        return False
+        return (move[0], move[1]) in self.valid_moves[players_color]
 
     def is_position_valid(self, posx, posy):
         '''
@@ -107,42 +182,37 @@ class GameBoard(object):
         :param dx: {int}
         :param dy: {int}
         :param players_color: {int} of player color
-        :return: {None}
+        :return: {list} of positions of the changed stones
         '''
+        changed = []
         posx = move[0]+dx
         posy = move[1]+dy
         while (not(self.board[posx][posy] == players_color)):
             self.board[posx][posy] = players_color
+            changed.append((posx, posy))
             posx += dx
             posy += dy
+        return changed
 
     def can_play(self, players_color):
         '''
         :param players_color: {int} of player color
         :return: True if there is a possible move for player
         '''
-        for x in range(self.board_size):
-            for y in range(self.board_size):
-                if self.is_correct_move([x, y], players_color):
-                    return True
-
-        return False
+        return len(self.valid_moves[players_color]) > 0
 
     def get_board_copy(self):
-        return copy.deepcopy(self.board)
+        '''
+        The board holds only ints, so copying the rows is enough (and much cheaper than a deep copy).
+        :return: {list} of rows of the board
+        '''
+        return [row[:] for row in self.board]
 
     def get_score(self):
         '''
         :return: {list} of {int} for player scores
         '''
-        stones = [0, 0]
-        for x in range(self.board_size):
-            for y in range(self.board_size):
-                if self.board[x][y] == self.p1_color:
-                    stones[0] += 1
-                if self.board[x][y] == self.p2_color:
-                    stones[1] += 1
-        return stones
+        return [self.stones[self.p1_color], self.stones[self.p2_color]]
 
     def print_board(self):
         for x in range(self.board_size):
@@ -160,12 +230,7 @@ class GameBoard(object):
         :param players_color: {int} of player color
         :return: {list} of valid moves
         '''
-        valid_moves = []
-        for x in range(self.board_size):
-            for y in range(self.board_size):
-                if ((self.board[x][y] == -1) and
-                   self.is_correct_move([x, y], players_color)):
-                    valid_moves.append((x, y))
+        valid_moves = sorted(self.valid_moves[players_color])
 
         if len(valid_moves) <= 0:
             print('No valid move!')
@@ -7,6 +7,29 @@ import time
 from game_board import GameBoard
 from player_creator import create_player
 
+
+def summarize_search_stats(stats):
+	'''
+	Aggregates search statistics of single moves reported by players with the 'stats_callback' attribute.
+	:param stats: {list} of {dict} with fields of player.SearchStats
+	:return: {dict} averages per move (depth and branching factor of searched moves only), empty if there are no stats
+	'''
+	if not stats:
+		return {}
+	searched = [move for move in stats if move['depth']]
+	factors = [move['branching_factor'] for move in stats if move['branching_factor'] is not None]
+	cutoffs = sum(move['cutoffs'] for move in stats)
+	return {
+		'moves': len(stats),
+		'nodes_per_move': sum(move['nodes'] for move in stats) / len(stats),
+		'mean_depth': sum(move['depth'] for move in searched) / len(searched) if searched else None,
+		'mean_branching_factor': sum(factors) / len(factors) if factors else None,
+		'first_move_cutoff_ratio': sum(move['first_move_cutoffs'] for move in stats) / cutoffs if cutoffs else None,
+		'transposition_hits_per_move': sum(move['transposition_hits'] for move in stats) / len(stats),
+		'mean_time': sum(move['time'] for move in stats) / len(stats),
+	}
+
+
 class HeadlessReversiCreator(object):
 	'''
 	Creator of the Reversi game without the GUI.
@@ -28,10 +51,20 @@ class HeadlessReversiCreator(object):
 		self.current_player_color = player1_color
 		self.player1_color = player1_color
 		self.player2_color = player2_color
-
-	def play_game(self):
+		# Durations of the moves of each player in ms and the numbers of nodes reported by players exposing the 'nodes' attribute
+		self.move_times = {player1_color: [], player2_color: []}
+		self.move_nodes = {player1_color: [], player2_color: []}
+		# Search statistics of players reporting them through the 'stats_callback' attribute
+		self.search_stats = {player1_color: [], player2_color: []}
+		for player, color in ((player1, player1_color), (player2, player2_color)):
+			if hasattr(player, 'stats_callback'):
+				player.stats_callback = self.search_stats[color].append
+
+	def play_game(self, verbose=True):
 		'''
 		This function contains the game loop that plays the game.
+		:param verbose: {bool} print the max move time and the winner of an unfinished game
+		:return: {list} stones of both players or None if a player made an incorrect move
 		'''
 		correct_finish = True
 		maxMoveTime = 0
@@ -40,11 +73,16 @@ class HeadlessReversiCreator(object):
 			move = self.current_player.move(self.board.get_board_copy())
 			endTime = time.time()
 			moveTime = (endTime - startTime) * 1000
+			self.move_times[self.current_player_color].append(moveTime)
+			nodes = getattr(self.current_player, 'nodes', None)
+			if nodes is not None:
+				self.move_nodes[self.current_player_color].append(nodes)
 			if move is None:
 				player_str = 'Player %d returns None instead of a valid move.' % (
 						self.current_player_color)
 				move_str = ' Move takes %.3f ms.' % moveTime
-				print(player_str + move_str)
+				if verbose:
+					print(player_str + move_str)
 				correct_finish = False
 				break
 			else:
@@ -60,8 +98,9 @@ class HeadlessReversiCreator(object):
 				self.board.play_move(move, self.current_player_color)
 
 			else:
-				print('Player %d made the wrong move [%d,%d]' % (
-						self.current_player_color, move[0], move[1]))
+				if verbose:
+					print('Player %d made the wrong move [%d,%d]' % (
+							self.current_player_color, move[0], move[1]))
 				correct_finish = False
 				break
 
@@ -80,15 +119,23 @@ class HeadlessReversiCreator(object):
 			#self.board.print_board()
 		if correct_finish:
 			#self.printFinalScore()
-			print(f'Max move time {maxMoveTime:.2f} ms')
+			if verbose:
+				print(f'Max move time {maxMoveTime:.2f} ms')
 			return self.countStones()
-		else:
+		elif verbose:
 			print('Game over.')
 			if self.current_player_color == self.player1_color:
 				print('Winner is player %d.' % (self.player2_color))
 			else:
 				print('Winner is player %d.' % (self.player1_color))
 
+	def get_search_summary(self, players_color):
+		'''
+		:param players_color: {int} color of the player
+		:return: {dict} aggregated search statistics of the player (see summarize_search_stats)
+		'''
+		return summarize_search_stats([stats._asdict() for stats in self.search_stats[players_color]])
+
 	def change_player(self):
 		'''
 		Change the current_player
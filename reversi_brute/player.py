@@ -1,17 +1,134 @@
-import itertools
 import collections
 import math
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+
+# Directions to the eight neighbouring tiles as changes of the x & y coordinates
+DIRECTIONS_X = [-1, -1, -1, 0, 1, 1,  1,  0]
+DIRECTIONS_Y = [-1,  0,  1, 1, 1, 0, -1, -1]
+
+# Number of entries of the transposition table (a power of two, the table is indexed by the low bits of the hash)
+TRANSPOSITION_TABLE_SIZE = 1 << 18
+# Seed of the generator of Zobrist keys. Fixed, so that the hashes (and hence the search) are reproducible
+ZOBRIST_SEED = 0x5eed
+
+# Default time budget of a single move in seconds. The tournament harness forfeits players exceeding 1 s per move
+MOVE_TIME_LIMIT = 0.8
+# The clock is checked once per this many visited nodes (must be a power of two)
+DEADLINE_CHECK_NODES = 256
+
+# Binary opening book - a sorted sequence of records (position hash, move), see load_opening_book
+OPENING_BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book.bin')
+OPENING_BOOK_RECORD = struct.Struct('<QB')
+
+# Positions with at most this many empty tiles are solved exactly
+ENDGAME_EMPTIES = 10
+# Part of the remaining time of a move the exact solver may use. If it does not finish, the usual search takes over
+ENDGAME_TIME_SHARE = 0.5
+# With more empty tiles, the exact solver orders moves by the mobility left to the opponent (cheaper parity ordering only otherwise)
+ENDGAME_MOBILITY_EMPTIES = 6
+
+# Weights of the features of the heuristic evaluation (see MyPlayer.evaluate). Integers, so that the values stay integral
+CORNER_WEIGHT = 16
+MOBILITY_WEIGHT = 2
+FRONTIER_WEIGHT = 1
+
+# Iterations shallower than this are searched by a single process even if workers are available, they take just a few milliseconds
+PARALLEL_MIN_DEPTH = 4
+
+# Types of values stored in the transposition table
+EXACT, LOWER_BOUND, UPPER_BOUND = range(3)
+TranspositionEntry = collections.namedtuple('TranspositionEntry', ['key', 'depth', 'bound', 'value', 'move', 'search'])
+
+# Statistics of the search of a single move, see MyPlayer.stats_callback. 'method' is one of 'book', 'endgame', 'search'.
+# branching_factor is the effective branching factor nodes ** (1 / depth), None for book moves
+SearchStats = collections.namedtuple('SearchStats', ['method', 'nodes', 'cutoffs', 'first_move_cutoffs', 'first_move_cutoff_ratio',
+	'transposition_hits', 'depth', 'branching_factor', 'time'])
+
+
+def load_opening_book(path=OPENING_BOOK_FILE):
+	# Loads the opening book as a dict mapping position hashes (see MyPlayer.compute_hash) to bit indices of the best moves.
+	# A missing file is an empty book
+	try:
+		with open(path, 'rb') as book_file:
+			data = book_file.read()
+	except FileNotFoundError:
+		return {}
+	return dict(OPENING_BOOK_RECORD.iter_unpack(data))
+
+
+def save_opening_book(book, path=OPENING_BOOK_FILE):
+	# Writes the dict {position hash: move} to a binary file readable by load_opening_book
+	with open(path, 'wb') as book_file:
+		for record in sorted(book.items()):
+			book_file.write(OPENING_BOOK_RECORD.pack(*record))
+
+
+class SearchTimeout(Exception):
+	# Raised from the depths of the search, when the deadline of the move is reached
+	pass
+
+
+# Player of a worker process of the parallel search, created by init_worker
+worker_player = None
+
+
+def init_worker(my_color, opponent_color, board_size, shared_alpha, alpha_lock):
+	# Initializer of the worker processes. Each worker keeps its own player (and so its own transposition table) for the whole game
+	global worker_player
+	worker_player = MyPlayer(my_color, opponent_color, board_size)
+	worker_player.shared_alpha = shared_alpha
+	worker_player.alpha_lock = alpha_lock
+
+
+def search_root_move(task):
+	# Searches the subtree of a single root move in a worker process. Returns tuple (value of the move or None if the deadline passed,
+	# counters of nodes, cutoffs, cutoffs by the first move and transposition hits)
+	my_bits, opponent_bits, move, flips, layers_remaining, deadline = task
+	player = worker_player
+	me, opponent = player.colors.me, player.colors.opponent
+	board = {me: my_bits, opponent: opponent_bits}
+	player.deadline = deadline
+	player.reset_counters()
+	player.searches += 1
+	player.start_search(board, me)
+	player.attempt_move(board, move, me, opponent, flips)
+	try:
+		value, _ = player.alpha_beta_prunning(player.refresh_root_alpha(), math.inf, layers_remaining, board, opponent, me, False)
+	except SearchTimeout:
+		value = None
+	else:
+		with player.alpha_lock:
+			if value > player.shared_alpha.value:
+				player.shared_alpha.value = value
+	return value, player.counters()
+
+
+def count_bits(bits):
+	# Returns the number of stones on a bitboard
+	return bin(bits).count('1')
+
 
 class MyPlayer():
 	'''Reversi player developed by Vojtech Michal.'''
 
 
 
-	#Uses alpha-beta pruning to optimize state space search (maximal depth 6 layers).
-	#Non-terminal states are evaluated by the difference of counts of my and opponent's stones,
-	#the rationale being that greater number of stones will lead to greater overall score.
-	#Capable of performing a move in about 450 ms on my machine.
-	
+	#Uses alpha-beta pruning to optimize state space search. The search is iteratively deepened until the time limit
+	#of the move runs out, the move found by the last completed iteration is played.
+	#The first moves are read from an opening book (opening_book.bin next to this file, rebuilt by running this file),
+	#positions with few empty tiles are solved exactly.
+	#Non-terminal states are evaluated by a weighted sum of differences between me and the opponent in the number of stones,
+	#corners, moves and frontier stones. The features are updated with each attempted move, so the evaluation itself is cheap.
+	#
+	#Internally the board is a dict mapping each color to its bitboard - an integer, whose bit x * board_size + y
+	#is set iff the player owns tile (x, y). Moves and stolen stones are found by shifting and masking whole bitboards
+	#at once, the list of lists board is converted only when entering and leaving move().
+
 
 	def __init__(self, my_color, opponent_color, board_size=8):
 		self.name = 'michavo3'
@@ -20,18 +137,179 @@ class MyPlayer():
 		self.board_size = board_size
 		colors = collections.namedtuple('colors', ['me', 'opponent', 'empty'])
 		self.colors = colors(my_color, opponent_color, -1)
-		self.max_depth = 6
-
-	def count_stone_difference(self, board):
-		#Computes a heuristic value for a state - the difference between number of my and opponent's stones
-		my = 0
-		others = 0
-		for x, y in itertools.product(range(self.board_size), repeat=2):
-			if self.tile_owner(x, y, board) == self.colors.me:
-				my += 1
-			if self.tile_owner(x, y, board) == self.colors.opponent:
-				others += 1
-		return my - others
+		# Upper limit of the number of layers searched, the time limit usually stops the search much earlier
+		self.max_depth = board_size * board_size
+		# Time budget of a move in seconds, can be changed after construction (create_player accepts only the three parameters above)
+		self.time_limit = MOVE_TIME_LIMIT
+		self.deadline = math.inf
+		# Counters of the current move, reported through stats_callback together with the depth reached and the method used
+		self.nodes = 0
+		self.cutoffs = 0
+		self.first_move_cutoffs = 0
+		self.transposition_hits = 0
+		self.depth_reached = 0
+		self.method = None
+		# Called with SearchStats after each move, if set. last_stats holds the statistics of the last move
+		self.stats_callback = None
+		self.last_stats = None
+		self.full_mask = (1 << board_size * board_size) - 1
+		self.shifts_up, self.shifts_down = self.build_shifts()
+		self.quadrants = self.build_quadrants()
+		self.neighbours = self.build_neighbours()
+		last = board_size - 1
+		self.corners = (1 << 0) | (1 << last) | (1 << (last * board_size)) | (1 << (last * board_size + last))
+		self.opening_book = load_opening_book()
+		self.build_zobrist_keys()
+		# Bounded table of already searched positions. Each slot holds a single TranspositionEntry or None
+		self.transpositions = [None] * TRANSPOSITION_TABLE_SIZE
+		# Number of calls of move(). Entries from older searches are replaced regardless of their depth
+		self.searches = 0
+		# Zobrist hash and features of the searched position (see start_search), maintained by attempt_move and undo_move.
+		# Their values in the positions preceding the attempted moves are kept on a stack, so that undo_move does not need to recompute them
+		self.hash = 0
+		self.stone_difference = 0
+		self.corner_difference = 0
+		self.frontier_difference = 0
+		self.history = []
+		# Parallel search splits the root moves among a pool of worker processes, started lazily by the first move.
+		# Set to more than 1 after construction to enable it
+		self.workers = 1
+		self.pool = None
+		self.pool_alpha = None
+		# Only in workers: best value of the root found so far by any worker (shared memory) and the lower bound for the root derived from it
+		self.shared_alpha = None
+		self.alpha_lock = None
+		self.root_alpha = -math.inf
+
+	def build_shifts(self):
+		# A step in direction (dx, dy) changes the bit index by dx * board_size + dy. A step in the y axis could wrap
+		# around the edge of the board to the neighbouring row, hence each shift comes with a mask of tiles, which can be
+		# reached without wrapping. Returns two lists of (shift, mask) pairs - for positive and for negative shifts
+		n = self.board_size
+		not_first_column = sum(1 << (x * n + y) for x in range(n) for y in range(1, n))
+		not_last_column = sum(1 << (x * n + y) for x in range(n) for y in range(n - 1))
+		shifts_up = []
+		shifts_down = []
+		for dx, dy in zip(DIRECTIONS_X, DIRECTIONS_Y):
+			mask = self.full_mask
+			if dy == 1:
+				mask &= not_first_column
+			elif dy == -1:
+				mask &= not_last_column
+			shift = dx * n + dy
+			if shift > 0:
+				shifts_up.append((shift, mask))
+			else:
+				shifts_down.append((-shift, mask))
+		return shifts_up, shifts_down
+
+	def build_quadrants(self):
+		# Returns a list, which holds the mask of the quadrant of the board for each tile. Used for parity ordering in the endgame
+		half = self.board_size // 2
+		masks = collections.defaultdict(int)
+		for x in range(self.board_size):
+			for y in range(self.board_size):
+				masks[x < half, y < half] |= 1 << (x * self.board_size + y)
+		return [masks[x < half, y < half] for x in range(self.board_size) for y in range(self.board_size)]
+
+	def build_neighbours(self):
+		# Returns a list, which holds the mask of the (up to eight) neighbouring tiles for each tile
+		neighbours = []
+		for tile in range(self.board_size * self.board_size):
+			bit = 1 << tile
+			mask = 0
+			for shift, shift_mask in self.shifts_up:
+				mask |= (bit << shift) & shift_mask
+			for shift, shift_mask in self.shifts_down:
+				mask |= (bit >> shift) & shift_mask
+			neighbours.append(mask)
+		return neighbours
+
+	def build_zobrist_keys(self):
+		# Every (color, tile) pair gets a random 64 bit key, hash of a position is the xor of keys of all placed stones
+		# and of the side key if the greater color is to move. Stealing a stone swaps its color, hence flip_keys holds xor of both keys of a tile.
+		# The keys depend on the colors only, not on which of them is mine, so that both players share the hashes of the opening book
+		generator = random.Random(ZOBRIST_SEED)
+		tiles = self.board_size * self.board_size
+		first_color, second_color = sorted((self.colors.me, self.colors.opponent))
+		self.stone_keys = {color: [generator.getrandbits(64) for _ in range(tiles)] for color in (first_color, second_color)}
+		self.flip_keys = [first ^ second for first, second in zip(self.stone_keys[first_color], self.stone_keys[second_color])]
+		self.side_key = generator.getrandbits(64)
+		self.side_key_color = second_color
+
+	def compute_hash(self, board, player):
+		# Computes the Zobrist hash of the position from scratch, 'player' is about to move
+		hash = self.side_key if player == self.side_key_color else 0
+		for color, keys in self.stone_keys.items():
+			bits = board[color]
+			while bits:
+				bit = bits & -bits
+				bits ^= bit
+				hash ^= keys[bit.bit_length() - 1]
+		return hash
+
+	def store_transposition(self, layers_remaining, bound, value, move):
+		# Saves the result of a search into the transposition table. A slot is overwritten unless it holds
+		# a deeper search of a different position made during the current move
+		index = self.hash & (TRANSPOSITION_TABLE_SIZE - 1)
+		entry = self.transpositions[index]
+		if entry is None or entry.key == self.hash or entry.search != self.searches or entry.depth <= layers_remaining:
+			self.transpositions[index] = TranspositionEntry(self.hash, layers_remaining, bound, value, move, self.searches)
+
+	def probe_transposition(self):
+		# Returns the entry of the transposition table for the current position or None, if it has not been searched yet
+		entry = self.transpositions[self.hash & (TRANSPOSITION_TABLE_SIZE - 1)]
+		return entry if entry is not None and entry.key == self.hash else None
+
+	def to_bitboards(self, board):
+		# Converts the list of lists board to a dict mapping colors to bitboards
+		bitboards = {self.colors.me: 0, self.colors.opponent: 0}
+		for x, row in enumerate(board):
+			for y, owner in enumerate(row):
+				if owner != self.colors.empty:
+					bitboards[owner] |= 1 << (x * self.board_size + y)
+		return bitboards
+
+	def reset_counters(self):
+		self.nodes = 0
+		self.cutoffs = 0
+		self.first_move_cutoffs = 0
+		self.transposition_hits = 0
+
+	def counters(self):
+		return self.nodes, self.cutoffs, self.first_move_cutoffs, self.transposition_hits
+
+	def add_counters(self, counters):
+		nodes, cutoffs, first_move_cutoffs, transposition_hits = counters
+		self.nodes += nodes
+		self.cutoffs += cutoffs
+		self.first_move_cutoffs += first_move_cutoffs
+		self.transposition_hits += transposition_hits
+
+	def start_search(self, board, player):
+		# Computes the hash and features of the root of a search from scratch, 'player' is about to move.
+		# Features are differences between me and the opponent in the number of stones, corners and frontier stones (next to an empty tile)
+		me, opponent = board[self.colors.me], board[self.colors.opponent]
+		empty = ~(me | opponent) & self.full_mask
+		next_to_empty = 0
+		for shift, mask in self.shifts_up:
+			next_to_empty |= (empty << shift) & mask
+		for shift, mask in self.shifts_down:
+			next_to_empty |= (empty >> shift) & mask
+		self.hash = self.compute_hash(board, player)
+		self.stone_difference = count_bits(me) - count_bits(opponent)
+		self.corner_difference = count_bits(me & self.corners) - count_bits(opponent & self.corners)
+		self.frontier_difference = count_bits(me & next_to_empty) - count_bits(opponent & next_to_empty)
+		self.history = []
+
+	def evaluate(self, board):
+		#Computes a heuristic value for a state from the features maintained during the search. More stones are better,
+		#corners can never be stolen, more moves give more options and frontier stones give the opponent moves.
+		#Mobility is counted on the board itself, so that the value depends on the position only and can be shared by the transposition table
+		me, opponent = board[self.colors.me], board[self.colors.opponent]
+		mobility = count_bits(self.generate_moves(me, opponent)) - count_bits(self.generate_moves(opponent, me))
+		return (self.stone_difference + CORNER_WEIGHT * self.corner_difference - FRONTIER_WEIGHT * self.frontier_difference
+			+ MOBILITY_WEIGHT * mobility)
 
 	def alpha_beta_prunning(self, alpha, beta, layers_remaining, board, current, other, is_max_node):
 		# Inspects a single node in the state space search tree and decides the best move.
@@ -39,36 +317,55 @@ class MyPlayer():
 		# Finds all currently possible moves for the player 'current'. Sorts them in decreasing order by the number of stones,
 		# that can be converted in a single move. Then iterates over them and recursively descends along branches of the search tree
 		# to evaluate subtrees. Attemps to cut branches from evaluation by employing the alpha beta pruning algorithm
-		# Returns tuple (node_value, optimal_next_move)
+		# Returns tuple (node_value, optimal_next_move), moves are bit indices
+		# Raises SearchTimeout if the deadline passes, the board is left modified in such case
+
+		self.nodes += 1
+		if self.nodes & (DEADLINE_CHECK_NODES - 1) == 0:
+			if time.perf_counter() > self.deadline:
+				raise SearchTimeout()
+			if self.shared_alpha is not None:
+				self.refresh_root_alpha()
+		# Values are relative to the root, so a lower bound of the root found by another worker holds in every node
+		alpha = max(alpha, self.root_alpha)
+		root_alpha = self.root_alpha
 
 		#Check whether we can go any deeper with the recursive search
 		if layers_remaining == 0:
 			#we cannot go further. What is the value of the current state?
-			difference = self.count_stone_difference(board)
-
-			return difference, None 
+			return self.evaluate(board), None
+
+		# The position might have been reached already by a different order of moves. Reuse its value if it was searched deep enough
+		entry = self.probe_transposition()
+		if entry is not None and entry.depth >= layers_remaining:
+			self.transposition_hits += 1
+			if entry.bound == EXACT:
+				return entry.value, entry.move
+			if entry.bound == LOWER_BOUND:
+				alpha = max(alpha, entry.value)
+			else:
+				beta = min(beta, entry.value)
+			if alpha >= beta:
+				return entry.value, entry.move
+		original_alpha, original_beta = alpha, beta
 
 		#It is possible to search firther down. Start by finding all possible moves
 		possible_moves = self.find_and_eval_moves(board, current, other)
 
 		if possible_moves is None:
-			#We have hit a terminal state (at least for us) - there are no more moves we can perform 
-			difference = self.count_stone_difference(board)
-
-			return difference, None 
+			#We have hit a terminal state (at least for us) - there are no more moves we can perform
+			return self.evaluate(board), None
 
 		best_move = possible_moves[0][0] #Dummy initializer. It is overwritten in any case
 		# value of this node. Unknown in the beginning, so we initialize it to an extreme value
 		value = -math.inf if is_max_node else math.inf
 
-		# As an extra heuristic, we perform the iteration in certain order. When new moves are searched, their values
-		# are estimated on the fly. We can use this value to check those moves first, that have possibility of yielding high value
-		possible_moves.sort(key=lambda data: data[1], reverse=True)
+		self.order_moves(possible_moves, entry)
 
 		# Virtually perform each move and check the consequences
-		for move, _ in possible_moves:
-			# Execute the specified move. List of changes is stored so that the board can be restored without excessive copying
-			temp_changes = self.attempt_move(board, move, current)
+		for index, (move, _, flips) in enumerate(possible_moves):
+			# Execute the specified move. Stolen stones are remembered so that the board can be restored without excessive copying
+			self.attempt_move(board, move, current, other, flips)
 
 			# Take a look what the opponent thinks about our move. The roles swap and the other player performs a search. The type of node (min/max) must be changed
 			child_val, _ = self.alpha_beta_prunning(alpha, beta, layers_remaining - 1, board, other, current, not is_max_node)
@@ -83,107 +380,349 @@ class MyPlayer():
 					beta, best_move = value, move
 
 			# Revert the move executed earlier in this function (so that the higher layer sees no modification)
-			board[move[0]][move[1]] = self.colors.empty #the tile with coordinates 'move' used to be unownned. Others were owned by the opponent
-			for x, y in temp_changes:
-				board[x][y] = other
+			self.undo_move(board, move, current, other, flips)
 
 			# And check whether we can save some time by exiting this subtree earlier
 			if alpha >= beta:
+				self.cutoffs += 1
+				self.first_move_cutoffs += index == 0
 				break
 
+		if value <= original_alpha:
+			bound = UPPER_BOUND
+		elif value >= original_beta:
+			bound = LOWER_BOUND
+		else:
+			bound = EXACT
+		# If another worker raised the bound of the root meanwhile, some subtrees were cut against a higher alpha
+		# than original_alpha and their values are mere upper bounds, so the bound type above is not reliable
+		if self.root_alpha == root_alpha:
+			self.store_transposition(layers_remaining, bound, value, best_move)
+
 		return (value, best_move)
 
-	def attempt_move(self, board, move, player):
-		#Modifies the given board inplace, as if the 'player' performed 'move'. Returns the list of stolen opponents stones
-		posx, posy = move
-		
-		board[posx][posy] = player
-		list_dx = [-1, -1, -1, 0, 1, 1, 1, 0]
-		list_dy = [-1, 0, 1, 1, 1, 0, -1, -1]
-
-		changes = []
-		otherPlayer = self.colors.opponent if player == self.colors.me else self.colors.me
-		for dir in zip(list_dx, list_dy):
-			if self.evaluate_move_in_direction(move, *dir, board, player, otherPlayer) > 0:
-				# There are some stones to be stolen in this direction.
-				# Go through them, steal them and add their coordinates to the list, so that we can restore them later
-				dx, dy = dir
-				posx = move[0] + dx
-				posy = move[1] + dy
-				while board[posx][posy] != player:
-					board[posx][posy] = player
-					changes.append((posx,posy))
-					posx += dx
-					posy += dy
-		return changes
+	def order_moves(self, possible_moves, entry):
+		# As an extra heuristic, we perform the iteration in certain order. When new moves are searched, their values
+		# are estimated on the fly. We can use this value to check those moves first, that have possibility of yielding high value
+		# The best move found by an earlier search of this position is the most promising one, so it goes first
+		hash_move = entry.move if entry is not None else None
+		possible_moves.sort(key=lambda data: (data[0] == hash_move, data[1]), reverse=True)
+
+	def refresh_root_alpha(self):
+		# Reads the best root value found by all workers. Values are integers, lowering the bound by one makes moves
+		# as good as the best one get exact values too, so that ties are broken by move order like in the serial search
+		self.root_alpha = self.shared_alpha.value - 1
+		return self.root_alpha
+
+	def start_pool(self):
+		# Starts the worker processes of the parallel search
+		self.pool_alpha = multiprocessing.Value('d', -math.inf, lock=False)
+		self.pool = multiprocessing.Pool(self.workers, init_worker,
+			(self.colors.me, self.colors.opponent, self.board_size, self.pool_alpha, multiprocessing.Lock()))
+
+	def close(self):
+		# Stops the worker processes of the parallel search, if there are any
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool = None
+			self.pool_alpha = None
+
+	def parallel_root_search(self, board, layers_remaining):
+		# Young brothers wait search of the root. The most promising move is searched first by this process to get a good bound,
+		# the remaining moves are then split among the workers, which tighten the bound for each other through shared memory.
+		# The result is the same as of alpha_beta_prunning with the same depth (ties go to the earlier move in the order).
+		# Returns tuple (root_value, optimal_next_move), raises SearchTimeout if the deadline passes
+		me, opponent = self.colors.me, self.colors.opponent
+		possible_moves = self.find_and_eval_moves(board, me, opponent)
+		self.order_moves(possible_moves, self.probe_transposition())
+
+		best_move, _, flips = possible_moves[0]
+		self.attempt_move(board, best_move, me, opponent, flips)
+		best_value, _ = self.alpha_beta_prunning(-math.inf, math.inf, layers_remaining - 1, board, opponent, me, False)
+		self.undo_move(board, best_move, me, opponent, flips)
+
+		self.pool_alpha.value = best_value
+		tasks = [(board[me], board[opponent], move, flips, layers_remaining - 1, self.deadline) for move, _, flips in possible_moves[1:]]
+		results = self.pool.map(search_root_move, tasks, chunksize=1)
+		for _, counters in results:
+			self.add_counters(counters)
+		values = [value for value, _ in results]
+		if None in values:
+			raise SearchTimeout()
+
+		for (move, _, _), value in zip(possible_moves[1:], values):
+			if value > best_value:
+				best_value, best_move = value, move
+		self.store_transposition(layers_remaining, EXACT, best_value, best_move)
+		return best_value, best_move
+
+	def attempt_move(self, board, move, player, other, flips=None):
+		#Modifies the given board inplace, as if the 'player' performed 'move'. Returns the bitboard of stolen opponents stones
+		#The hash and features are updated too. Only the tile of the move, the stolen stones and the neighbours of the move
+		#(which might have lost their last empty neighbour) can change their contribution to the frontier
+		own, opponent = board[player], board[other]
+		move_bit = 1 << move
+		if flips is None:
+			flips = self.compute_flips(move_bit, own, opponent)
+		self.history.append((self.hash, self.stone_difference, self.corner_difference, self.frontier_difference))
+
+		empty_before = ~(own | opponent) & self.full_mask
+		empty = empty_before ^ move_bit
+		hash = self.hash ^ self.stone_keys[player][move] ^ self.side_key
+		# Change of the frontier difference from the point of view of 'player'
+		frontier = 1 if self.neighbours[move] & empty else 0
+		changed = flips | (self.neighbours[move] & (own | opponent))
+		while changed:
+			bit = changed & -changed
+			changed ^= bit
+			tile = bit.bit_length() - 1
+			was_frontier = 1 if self.neighbours[tile] & empty_before else 0
+			is_frontier = 1 if self.neighbours[tile] & empty else 0
+			if bit & flips:
+				hash ^= self.flip_keys[tile]
+				frontier += is_frontier + was_frontier
+			elif bit & own:
+				frontier += is_frontier - was_frontier
+			else:
+				frontier -= is_frontier - was_frontier
+
+		sign = 1 if player == self.colors.me else -1
+		self.hash = hash
+		self.stone_difference += sign * (1 + 2 * count_bits(flips))
+		if move_bit & self.corners:
+			self.corner_difference += sign
+		self.frontier_difference += sign * frontier
+
+		board[player] = own | flips | move_bit
+		board[other] = opponent & ~flips
+		return flips
 
+	def undo_move(self, board, move, player, other, flips):
+		#Reverts attempt_move - the tile 'move' used to be unowned, the stolen stones were owned by the other player
+		board[player] &= ~(flips | (1 << move))
+		board[other] |= flips
+		self.hash, self.stone_difference, self.corner_difference, self.frontier_difference = self.history.pop()
 
 	def move(self, board):
 		# Called by external code to get the next move to perform.
-
-		alpha = -math.inf
-		beta = math.inf
+		start = time.perf_counter()
+		self.deadline = start + self.time_limit
+
+		optimal_move = self.search(self.to_bitboards(board))
+
+		if optimal_move is not None:
+			self.report_stats(time.perf_counter() - start)
+		return None if optimal_move is None else divmod(optimal_move, self.board_size)
+
+	def report_stats(self, elapsed):
+		# Collects statistics of the finished move into last_stats and passes them to stats_callback
+		depth = self.depth_reached
+		self.last_stats = SearchStats(
+			method=self.method,
+			nodes=self.nodes,
+			cutoffs=self.cutoffs,
+			first_move_cutoffs=self.first_move_cutoffs,
+			first_move_cutoff_ratio=self.first_move_cutoffs / self.cutoffs if self.cutoffs else None,
+			transposition_hits=self.transposition_hits,
+			depth=depth,
+			branching_factor=self.nodes ** (1 / depth) if depth > 0 else None,
+			time=elapsed)
+		if self.stats_callback is not None:
+			self.stats_callback(self.last_stats)
+
+	def search(self, root):
+		# Finds the best move for me in the position given as bitboards. Returns its bit index or None if I cannot move.
+		# The opening book is consulted first, positions close to the end of the game are solved exactly, the remaining ones are searched
+		possible_moves = self.find_and_eval_moves(root, self.colors.me, self.colors.opponent)
+		if possible_moves is None:
+			return None
+		empty_tiles = count_bits(~(root[self.colors.me] | root[self.colors.opponent]) & self.full_mask)
+
+		self.searches += 1
+		self.reset_counters()
+		self.depth_reached = 0
+
+		book_move = self.opening_book.get(self.compute_hash(root, self.colors.me))
+		if book_move is not None and any(move == book_move for move, _, _ in possible_moves):
+			self.method = 'book'
+			return book_move
+
+		if empty_tiles <= ENDGAME_EMPTIES:
+			deadline = self.deadline
+			self.deadline = time.perf_counter() + (deadline - time.perf_counter()) * ENDGAME_TIME_SHARE
+			try:
+				_, optimal_move = self.solve_endgame(root[self.colors.me], root[self.colors.opponent], -math.inf, math.inf)
+				self.method = 'endgame'
+				self.depth_reached = empty_tiles
+				return optimal_move
+			except SearchTimeout:
+				pass
+			finally:
+				self.deadline = deadline
+
+		# Fallback in case not even the first iteration finishes in time
+		optimal_move = max(possible_moves, key=lambda data: data[1])[0]
+		self.method = 'search'
 
 		#Initiate recursive search for the optimal move using alpha beta prunning of the search tree. The root is one big max node (my choice of move)
-		_, optimal_move = self.alpha_beta_prunning(alpha, beta, self.max_depth - 1, board, self.colors.me, self.colors.opponent, True)
+		#Each iteration searches one layer deeper. Shallower iterations are cheap and leave best moves in the transposition table,
+		#which are then tried first by the deeper iterations
+		if self.workers > 1 and self.pool is None:
+			self.start_pool()
+		for depth in range(1, min(self.max_depth, empty_tiles) + 1):
+			# An interrupted search leaves stones of attempted moves on the board, so each iteration gets a fresh copy
+			board = dict(root)
+			self.start_search(board, self.colors.me)
+			try:
+				if self.pool is not None and depth >= PARALLEL_MIN_DEPTH:
+					_, optimal_move = self.parallel_root_search(board, depth)
+				else:
+					_, optimal_move = self.alpha_beta_prunning(-math.inf, math.inf, depth, board, self.colors.me, self.colors.opponent, True)
+			except SearchTimeout:
+				break
+			self.depth_reached = depth
 
 		return optimal_move
 
-	def tile_within_bounds(self, posx, posy):
-		# Returns true iff (posx, posy) is a valid coordinate
-		return ((posx >= 0) and (posx < self.board_size) and
-				(posy >= 0) and (posy < self.board_size))
-
-	def tile_owner(self, posx, posy, board):
-		# Returns the color of player owning the tile (posx, posy)
-		return board[posx][posy]
-
-	def evaluate_move(self, move, board, currentPlayer, otherPlayer):
-		# Returns the number of enemy stones stolen by performing the 'move'
-
-		dx = [-1, -1, -1, 0, 1, 1,  1,  0]
-		dy = [-1,  0,  1, 1, 1, 0, -1, -1]
-
-		#evaluate the move in all directions represented by pairs of change in x & y axis and sum all partial values
-		return sum(self.evaluate_move_in_direction(move, *dir, board, currentPlayer, otherPlayer) for dir in zip(dx, dy))
-
-	def evaluate_move_in_direction(self, move, dx, dy, board, currentPlayer, otherPlayer):
-		# Returns the number of enemy stones stolen by performing the 'move', only takes a look at a single line
-		posx = move[0] + dx
-		posy = move[1] + dy
-
-		# Prevent accessing out of bounds or violating the rules of reversi
-		if not self.tile_within_bounds(posx, posy) or self.tile_owner(posx, posy, board) != otherPlayer:
-			return 0
-
-		#Now we know that [posx, posy] is an opponent's stone and we can move to the next tile right away
-		posx += dx
-		posy += dy
-		opponent_stones = 1
-
-		#Let's search for the end of line of opponent's stones and count them
-		while self.tile_within_bounds(posx, posy):
-			owner = self.tile_owner(posx, posy, board)
-			if owner == self.colors.empty: #we have hit an empty tile. Such line is not enclosed by our stones and we cannot convert it
-				return 0
-			if owner == currentPlayer: #our stone is on the other side - we can convert stones. Return the number of trapped opponent stones
-				return opponent_stones
-			posx += dx
-			posy += dy
-			opponent_stones += 1
-
-		#We have run out of valid positions, that means that the opponent's stones hug wall and we cannot convert them
-		return 0
+	def solve_endgame(self, own, opponent, alpha, beta, passed=False):
+		# Exact negamax search till the end of the game, the owner of 'own' is to move. Unlike alpha_beta_prunning,
+		# a player without moves passes and the game ends only when neither player can move.
+		# Returns tuple (final difference of stones of the player to move and his opponent, optimal move)
+		# Raises SearchTimeout if the deadline passes
+
+		self.nodes += 1
+		if self.nodes & (DEADLINE_CHECK_NODES - 1) == 0 and time.perf_counter() > self.deadline:
+			raise SearchTimeout()
+
+		moves = self.generate_moves(own, opponent)
+		if not moves:
+			if passed:
+				return count_bits(own) - count_bits(opponent), None
+			value, _ = self.solve_endgame(opponent, own, -beta, -alpha, True)
+			return -value, None
+
+		# Moves into quadrants with an odd number of empty tiles go first - the player moving there is likely to get the last move
+		# of the quadrant too. With enough empty tiles, moves leaving the opponent fewer replies go first among them
+		empty = ~(own | opponent) & self.full_mask
+		with_mobility = count_bits(empty) > ENDGAME_MOBILITY_EMPTIES
+		children = []
+		while moves:
+			move_bit = moves & -moves
+			moves ^= move_bit
+			move = move_bit.bit_length() - 1
+			flips = self.compute_flips(move_bit, own, opponent)
+			new_own = own | flips | move_bit
+			new_opponent = opponent & ~flips
+			even = 1 - (count_bits(empty & self.quadrants[move]) & 1)
+			mobility = count_bits(self.generate_moves(new_opponent, new_own)) if with_mobility else 0
+			children.append(((even, mobility), move, new_own, new_opponent))
+		children.sort(key=lambda child: child[0])
+
+		best_value = -math.inf
+		best_move = children[0][1]
+		for index, (_, move, new_own, new_opponent) in enumerate(children):
+			value, _ = self.solve_endgame(new_opponent, new_own, -beta, -alpha)
+			value = -value
+			if value > best_value:
+				best_value, best_move = value, move
+				alpha = max(alpha, value)
+				if alpha >= beta:
+					self.cutoffs += 1
+					self.first_move_cutoffs += index == 0
+					break
+		return best_value, best_move
+
+	def generate_moves(self, own, opponent):
+		# Returns the bitboard of all tiles, where the owner of 'own' can place a stone.
+		# For each direction, a line of opponent's stones starting next to own stone is grown one step at a time,
+		# a move is possible on the empty tile right behind it
+		empty = ~(own | opponent) & self.full_mask
+		moves = 0
+		for shift, mask in self.shifts_up:
+			line = (own << shift) & mask & opponent
+			while line:
+				line = (line << shift) & mask
+				moves |= line & empty
+				line &= opponent
+		for shift, mask in self.shifts_down:
+			line = (own >> shift) & mask & opponent
+			while line:
+				line = (line >> shift) & mask
+				moves |= line & empty
+				line &= opponent
+		return moves
+
+	def compute_flips(self, move_bit, own, opponent):
+		# Returns the bitboard of opponent's stones stolen by placing a stone on 'move_bit'
+		flips = 0
+		for shift, mask in self.shifts_up:
+			line = 0
+			tile = (move_bit << shift) & mask
+			while tile & opponent:
+				line |= tile
+				tile = (tile << shift) & mask
+			if tile & own:
+				flips |= line
+		for shift, mask in self.shifts_down:
+			line = 0
+			tile = (move_bit >> shift) & mask
+			while tile & opponent:
+				line |= tile
+				tile = (tile >> shift) & mask
+			if tile & own:
+				flips |= line
+		return flips
 
 	def find_and_eval_moves(self, board, currentPlayer, otherPlayer):
-		# Returns a list of ((x, y), value) of all moves that can be performed by 'currentPlayer' or None if there are no valid moves.
+		# Returns a list of (move, value, stolen_stones) of all moves that can be performed by 'currentPlayer' or None if there are no valid moves.
+		# Moves are bit indices in increasing order, value is the number of enemy stones stolen by the move
+		own = board[currentPlayer]
+		opponent = board[otherPlayer]
+		moves = self.generate_moves(own, opponent)
 		valid_moves = []
-		for x, y in itertools.product(range(self.board_size),repeat=2):
-			#Check every tile. If it's empty, try to simulate a move. If it would have nonnegative value
-			# (i.e. there are some enemy stones to be stolen in the neighbourhood), add it to the list of valid moves
-			if self.tile_owner(x, y, board) == self.colors.empty:
-				value = self.evaluate_move([x, y], board, currentPlayer, otherPlayer)
-				if value > 0:
-					valid_moves.append(((x, y), value))
+		while moves:
+			move_bit = moves & -moves
+			moves ^= move_bit
+			flips = self.compute_flips(move_bit, own, opponent)
+			valid_moves.append((move_bit.bit_length() - 1, count_bits(flips), flips))
 
 		return None if len(valid_moves) <= 0 else valid_moves
+
+
+def build_opening_book(plies, time_limit, board_size=8, first_color=0, second_color=1):
+	# Searches every position reachable in less than 'plies' moves from the initial position (first_color moves first)
+	# with the given time per position. Returns the book as a dict {position hash: best move}
+	players = {first_color: MyPlayer(first_color, second_color, board_size), second_color: MyPlayer(second_color, first_color, board_size)}
+	half = board_size // 2
+	initial = {
+		first_color: (1 << ((half - 1) * board_size + half - 1)) | (1 << (half * board_size + half)),
+		second_color: (1 << (half * board_size + half - 1)) | (1 << ((half - 1) * board_size + half)),
+	}
+	book = {}
+	positions = [(initial, first_color, second_color)]
+	for ply in range(plies):
+		next_positions = []
+		for board, current, other in positions:
+			player = players[current]
+			player.opening_book = {}
+			hash = player.compute_hash(board, current)
+			if hash in book:
+				continue
+			player.deadline = time.perf_counter() + time_limit
+			book[hash] = player.search(board)
+			moves = player.find_and_eval_moves(board, current, other) or []
+			for move, _, flips in moves:
+				child = dict(board)
+				player.attempt_move(child, move, current, other, flips)
+				next_positions.append((child, other, current))
+		positions = next_positions
+	return book
+
+
+if __name__ == '__main__':
+	# usage: python player.py [plies [seconds per position]] - (re)builds the opening book
+	plies = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	time_limit = float(sys.argv[2]) if len(sys.argv) > 2 else 2 * MOVE_TIME_LIMIT
+	book = build_opening_book(plies, time_limit)
+	save_opening_book(book)
+	print('Saved {} positions to {}'.format(len(book), OPENING_BOOK_FILE))
@@ -0,0 +1,265 @@
+'''
+Plays a round robin tournament of reversi players on top of HeadlessReversiCreator.
+
+Each pair of players plays the given number of games across a pool of processes. Games come in pairs sharing
+a random opening, with the colors swapped. Reports win/draw/loss counts with a Wilson confidence interval of the score,
+move latencies (p50/p95/max and a histogram), searched nodes of players exposing the 'nodes' attribute and search
+statistics (depth, branching factor, cutoffs, transposition hits) of players reporting them through 'stats_callback'.
+
+usage: python tournament.py [-g games] [-w workers] [-o opening_plies] [-s seed] [-j results.json] [-c results.csv] player [player ...]
+(a single player plays against itself, its results are then reported separately for the first and the second seat)
+'''
+import bisect
+import csv
+import getopt
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import sys
+
+from game_board import GameBoard
+from headless_reversi_creator import HeadlessReversiCreator, summarize_search_stats
+from player_creator import create_player
+
+GAMES_PER_PAIRING = 20
+OPENING_PLIES = 4
+BOARD_SIZE = 8
+# z-score of the two sided 95% confidence interval
+CONFIDENCE_Z = 1.96
+# Upper bounds of the buckets of the move latency histogram in ms
+LATENCY_BUCKETS = [1, 10, 50, 100, 250, 500, 750, 1000, math.inf]
+FIRST_COLOR = 0
+SECOND_COLOR = 1
+SEATS = ('first', 'second')
+
+
+def load_player_module(name):
+	'''
+	Imports the module of a player the same way as headless_reversi_creator does.
+	:param name: {str} module name, optionally with the .py suffix
+	'''
+	return __import__(name.replace('.py', ''))
+
+
+def random_opening(plies, rng, board_size=BOARD_SIZE):
+	'''
+	Plays random moves from the initial position, FIRST_COLOR moves first.
+	:return: {list} of moves, the colors alternate (stops early if a player would have to pass)
+	'''
+	board = GameBoard(board_size, FIRST_COLOR, SECOND_COLOR)
+	color, other = FIRST_COLOR, SECOND_COLOR
+	opening = []
+	for _ in range(plies):
+		moves = board.get_all_valid_moves(color)
+		if not moves:
+			break
+		move = rng.choice(moves)
+		board.play_move(move, color)
+		opening.append(move)
+		color, other = other, color
+	return opening
+
+
+def play_match(task):
+	'''
+	Plays a single game in a worker process.
+	:param task: {tuple} (first player module, second player module, opening moves, board size), the first player gets FIRST_COLOR
+	:return: {dict} names of both players, their stones, whether the game ended by a forfeit, move times, nodes and search statistics
+	'''
+	first_name, second_name, opening, board_size = task
+	first = create_player(load_player_module(first_name).MyPlayer, FIRST_COLOR, SECOND_COLOR, board_size)
+	second = create_player(load_player_module(second_name).MyPlayer, SECOND_COLOR, FIRST_COLOR, board_size)
+	game = HeadlessReversiCreator(first, FIRST_COLOR, second, SECOND_COLOR, board_size)
+	for move in opening:
+		game.board.play_move(move, game.current_player_color)
+		game.change_player()
+
+	stones = game.play_game(verbose=False)
+	forfeit = stones is None
+	if forfeit:
+		# The player on turn returned an incorrect move and loses
+		stones = [0, 1] if game.current_player_color == FIRST_COLOR else [1, 0]
+
+	for player in (first, second):
+		close = getattr(player, 'close', None)
+		if close is not None:
+			close()
+	return {
+		'players': [first_name, second_name],
+		'stones': stones,
+		'forfeit': forfeit,
+		'move_times': [game.move_times[FIRST_COLOR], game.move_times[SECOND_COLOR]],
+		'move_nodes': [game.move_nodes[FIRST_COLOR], game.move_nodes[SECOND_COLOR]],
+		'search_stats': [[stats._asdict() for stats in game.search_stats[color]] for color in (FIRST_COLOR, SECOND_COLOR)],
+	}
+
+
+def percentile(values, q):
+	'''
+	Nearest rank percentile of a non-empty list.
+	:param q: {float} percentile in the range [0, 100]
+	'''
+	ordered = sorted(values)
+	rank = max(1, math.ceil(q / 100 * len(ordered)))
+	return ordered[rank - 1]
+
+
+def score_interval(scores):
+	'''
+	Mean score (1 for a win, 0.5 for a draw, 0 for a loss) with its Wilson score confidence interval. A draw counts
+	as half a win. Unlike the normal approximation, the Wilson interval keeps a non-zero width for small samples
+	and when all games end the same way (e.g. a 2-0 sweep).
+	:return: {tuple} (mean, lower bound, upper bound)
+	'''
+	n = len(scores)
+	mean = sum(scores) / n
+	z2 = CONFIDENCE_Z ** 2
+	center = (mean + z2 / (2 * n)) / (1 + z2 / n)
+	margin = CONFIDENCE_Z / (1 + z2 / n) * math.sqrt(mean * (1 - mean) / n + z2 / (4 * n * n))
+	return mean, max(0.0, center - margin), min(1.0, center + margin)
+
+
+def latency_statistics(times):
+	'''
+	:param times: {list} move durations in ms
+	:return: {dict} p50, p95, max and the histogram with LATENCY_BUCKETS
+	'''
+	if not times:
+		return {'p50': None, 'p95': None, 'max': None, 'histogram': {}}
+	return {'p50': percentile(times, 50), 'p95': percentile(times, 95), 'max': max(times), 'histogram': latency_histogram(times)}
+
+
+def latency_histogram(times):
+	'''
+	Counts the move durations falling into each bucket of LATENCY_BUCKETS.
+	:return: {dict} mapping labels of the buckets ('<=1ms', '<=10ms', ..., '>1000ms') to counts
+	'''
+	counts = [0] * len(LATENCY_BUCKETS)
+	for time in times:
+		counts[bisect.bisect_left(LATENCY_BUCKETS, time)] += 1
+	labels = ['<={}ms'.format(upper) for upper in LATENCY_BUCKETS[:-1]] + ['>{}ms'.format(LATENCY_BUCKETS[-2])]
+	return dict(zip(labels, counts))
+
+
+def summarize(results):
+	'''
+	Aggregates game results per player and per pairing.
+	:return: {list} of {dict} rows, one per (player, opponent) pair, players of self-play are suffixed with their seat
+	'''
+	games = {}
+	for result in results:
+		first_stones, second_stones = result['stones']
+		players = result['players']
+		if players[0] == players[1]:
+			# Both sides of self-play would share one record scoring exactly 0.5, so they are told apart by the seat
+			players = ['{} ({})'.format(name, seat) for name, seat in zip(players, SEATS)]
+		for index, (player, opponent) in enumerate([players, players[::-1]]):
+			record = games.setdefault((player, opponent), {'scores': [], 'forfeits': 0, 'times': [], 'nodes': [], 'node_times': [], 'search_stats': []})
+			own, other = (first_stones, second_stones) if index == 0 else (second_stones, first_stones)
+			record['scores'].append(1.0 if own > other else 0.5 if own == other else 0.0)
+			record['forfeits'] += result['forfeit'] and own < other
+			record['times'].extend(result['move_times'][index])
+			nodes = result['move_nodes'][index]
+			record['nodes'].extend(nodes)
+			if nodes:
+				record['node_times'].extend(result['move_times'][index])
+			record['search_stats'].extend(result['search_stats'][index])
+
+	rows = []
+	for (player, opponent), record in sorted(games.items()):
+		scores = record['scores']
+		score, lower, upper = score_interval(scores)
+		latency = latency_statistics(record['times'])
+		node_time = sum(record['node_times']) / 1000
+		search = summarize_search_stats(record['search_stats'])
+		rows.append({
+			'player': player,
+			'opponent': opponent,
+			'games': len(scores),
+			'wins': scores.count(1.0),
+			'draws': scores.count(0.5),
+			'losses': scores.count(0.0),
+			'forfeits': record['forfeits'],
+			'score': score,
+			'score_lower': lower,
+			'score_upper': upper,
+			'latency_p50_ms': latency['p50'],
+			'latency_p95_ms': latency['p95'],
+			'latency_max_ms': latency['max'],
+			'latency_histogram': latency['histogram'],
+			'nodes_per_move': sum(record['nodes']) / len(record['nodes']) if record['nodes'] else None,
+			'nodes_per_second': sum(record['nodes']) / node_time if node_time > 0 else None,
+			'mean_depth': search.get('mean_depth'),
+			'mean_branching_factor': search.get('mean_branching_factor'),
+			'first_move_cutoff_ratio': search.get('first_move_cutoff_ratio'),
+			'transposition_hits_per_move': search.get('transposition_hits_per_move'),
+		})
+	return rows
+
+
+def write_json(rows, results, path):
+	with open(path, 'w') as output:
+		json.dump({'summary': rows, 'games': results}, output, indent=2)
+
+
+def write_csv(rows, path):
+	columns = [column for column in rows[0] if column != 'latency_histogram'] if rows else []
+	with open(path, 'w', newline='') as output:
+		writer = csv.DictWriter(output, columns, extrasaction='ignore')
+		writer.writeheader()
+		writer.writerows(rows)
+
+
+def run_tournament(player_names, games=GAMES_PER_PAIRING, workers=None, opening_plies=OPENING_PLIES, seed=None, board_size=BOARD_SIZE):
+	'''
+	Plays all pairings of the given players.
+	:param player_names: {list} of player module names, a single player plays against itself (see summarize)
+	:param games: {int} games per pairing, rounded up to an even number (each opening is played with both colors)
+	:param workers: {int} number of processes, all CPUs by default
+	:return: {tuple} (summary rows, list of results of single games)
+	'''
+	rng = random.Random(seed)
+	pairings = list(itertools.combinations(player_names, 2)) or [(player_names[0], player_names[0])]
+	tasks = []
+	for first, second in pairings:
+		for _ in range((games + 1) // 2):
+			opening = random_opening(opening_plies, rng, board_size)
+			tasks.append((first, second, opening, board_size))
+			tasks.append((second, first, opening, board_size))
+
+	with multiprocessing.Pool(workers) as pool:
+		results = pool.map(play_match, tasks, chunksize=1)
+	return summarize(results), results
+
+
+if __name__ == '__main__':
+	(choices, args) = getopt.getopt(sys.argv[1:], 'g:w:o:s:j:c:')
+	options = dict(choices)
+	if not args:
+		print(__doc__)
+		sys.exit(1)
+
+	rows, results = run_tournament(args,
+		games=int(options.get('-g', GAMES_PER_PAIRING)),
+		workers=int(options['-w']) if '-w' in options else None,
+		opening_plies=int(options.get('-o', OPENING_PLIES)),
+		seed=int(options['-s']) if '-s' in options else None)
+
+	print('{:<24} {:<24} {:>5} {:>11} {:>21} {:>8} {:>8} {:>8} {:>12} {:>6} {:>6}'.format(
+		'player', 'opponent', 'games', 'W/D/L', 'score (95% CI)', 'p50 ms', 'p95 ms', 'max ms', 'nodes/move', 'depth', 'EBF'))
+	for row in rows:
+		nodes = '-' if row['nodes_per_move'] is None else '{:.0f}'.format(row['nodes_per_move'])
+		depth = '-' if row['mean_depth'] is None else '{:.1f}'.format(row['mean_depth'])
+		factor = '-' if row['mean_branching_factor'] is None else '{:.2f}'.format(row['mean_branching_factor'])
+		print('{:<24} {:<24} {:>5} {:>11} {:>21} {:>8.1f} {:>8.1f} {:>8.1f} {:>12} {:>6} {:>6}'.format(
+			row['player'], row['opponent'], row['games'],
+			'{}/{}/{}'.format(row['wins'], row['draws'], row['losses']),
+			'{:.3f} ({:.3f}-{:.3f})'.format(row['score'], row['score_lower'], row['score_upper']),
+			row['latency_p50_ms'], row['latency_p95_ms'], row['latency_max_ms'], nodes, depth, factor))
+
+	if '-j' in options:
+		write_json(rows, results, options['-j'])
+	if '-c' in options:
+		write_csv(rows, options['-c'])